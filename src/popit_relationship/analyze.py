@@ -0,0 +1,154 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import ujson
+from loguru import logger
+
+from popit_relationship.common import KEY_TYPE, node_type_index, state_load, state_save
+from popit_relationship.store import (
+    SHARD_ANALYSIS,
+    graph_init_shard,
+    shard_load,
+    shard_save,
+)
+
+# the attributes written by the analysis, computed again rather than exported
+METRIC_LIST = (
+    "component",
+    "component_size",
+    "degree_centrality",
+    "betweenness_centrality",
+)
+
+_graph = None
+
+
+def graph_analyze(workers=None, force=False):
+    # metrics are only kept for nodes still in the other shards, so those of nodes
+    # removed since the last analysis are dropped with it
+    analysis = analysis_graph_build(graph_init_shard((SHARD_ANALYSIS,)))
+    content_hash = analysis_hash(analysis)
+    state = state_load()
+
+    if (
+        not force
+        and state.get("analysis", None) == content_hash
+        and len(shard_load(SHARD_ANALYSIS))
+    ):
+        logger.info("The graph did not change since the last analysis, skipping")
+        return False
+
+    shard = nx.MultiDiGraph()
+
+    for node, metric in metric_build(analysis, workers).items():
+        shard.add_node(node, **metric)
+
+    logger.info(
+        "Analyzed {} nodes in {} components",
+        len(shard),
+        nx.number_connected_components(analysis),
+    )
+
+    # kept in a shard of its own, so that it is merged into the nodes of every type
+    # and pushed to Neo4j along with them
+    shard_save(SHARD_ANALYSIS, shard)
+
+    state = state_load()
+    state["analysis"] = content_hash
+    state_save(state)
+
+    return True
+
+
+def analysis_graph_build(graph):
+    # type statements would put every node of a type in the same component
+    class_list = set(node_type_index(graph).values())
+    analysis = nx.Graph()
+
+    analysis.add_nodes_from(node for node in graph if node not in class_list)
+    analysis.add_edges_from(
+        (source, dest)
+        for source, dest, key in graph.edges(keys=True)
+        if not key == KEY_TYPE and source not in class_list and dest not in class_list
+    )
+
+    return analysis
+
+
+def analysis_hash(analysis):
+    return hashlib.blake2b(
+        ujson.dumps(
+            [
+                sorted(analysis.nodes),
+                sorted(sorted(edge) for edge in analysis.edges),
+            ]
+        ).encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+def metric_build(analysis, workers=None):
+    size = len(analysis)
+    # numbered from the largest, in the same order on every run
+    component_list = sorted(
+        nx.connected_components(analysis),
+        key=lambda component: (-len(component), min(component)),
+    )
+    metric = {}
+
+    for index, component in enumerate(component_list):
+        for node in component:
+            metric[node] = {
+                "component": index,
+                "component_size": len(component),
+                "degree_centrality": (
+                    analysis.degree(node) / (size - 1) if size > 1 else 0.0
+                ),
+                "betweenness_centrality": 0.0,
+            }
+
+    # shortest paths never leave a component, so every chunk of sources is only
+    # searched within its own, and components of two nodes have none going through
+    chunk_size = int(os.environ.get("ANALYZE_CHUNK_SIZE", 100))
+    chunk_list = [
+        component_node_list[i : i + chunk_size]
+        for component_node_list in (
+            sorted(component) for component in component_list if len(component) > 2
+        )
+        for i in range(0, len(component_node_list), chunk_size)
+    ]
+
+    if not chunk_list:
+        return metric
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=worker_init, initargs=(analysis,)
+    ) as executor:
+        for result in executor.map(betweenness_chunk, chunk_list):
+            for node, value in result.items():
+                metric[node]["betweenness_centrality"] += value
+
+    # normalized as networkx does for undirected graphs
+    if size > 2:
+        for node in metric:
+            metric[node]["betweenness_centrality"] *= 2 / ((size - 1) * (size - 2))
+
+    return metric
+
+
+def worker_init(analysis):
+    global _graph
+
+    _graph = analysis
+
+
+def betweenness_chunk(source_list):
+    return {
+        node: value
+        for node, value in nx.betweenness_centrality_subset(
+            _graph, source_list, list(_graph), normalized=False
+        ).items()
+        if value
+    }
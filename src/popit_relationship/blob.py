@@ -0,0 +1,139 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from loguru import logger
+
+BLOB_PATH_DEFAULT = "./primport-blobs.bin"
+BLOB_ATTRIBUTES = ("biography", "summary")
+KEY_BLOB = "@blob"
+
+# every record is the digest and length of its content, followed by the content
+HEADER = struct.Struct(">16sI")
+
+_store_list = {}
+
+
+class BlobStore:
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.map = None
+
+    def append(self, value):
+        content = value.encode("utf-8")
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+
+        if self.index is None:
+            self.index = blob_index_build(self.path)
+
+        # the same biography is fetched again on every sync, only keep one copy
+        if digest not in self.index:
+            # unbuffered, so that the record goes out in a single append even when
+            # another sync process is writing to the same file
+            with open(self.path, "ab", buffering=0) as blob_file:
+                blob_file.write(HEADER.pack(digest, len(content)) + content)
+                self.index[digest] = blob_file.tell() - len(content)
+
+        return [self.index[digest], len(content)]
+
+    def read(self, reference):
+        offset, length = reference
+
+        if self.map is None or offset + length > len(self.map):
+            self.remap()
+
+        # e.g. the blob file was deleted or reset while the cache still refers to it
+        if self.map is None or offset + length > len(self.map):
+            logger.warning("{} is not in {}, leaving it out", reference, self.path)
+            return None
+
+        return self.map[offset : offset + length].decode("utf-8")
+
+    def remap(self):
+        self.close()
+
+        try:
+            with open(self.path, "rb") as blob_file:
+                # an empty file cannot be mapped
+                if os.fstat(blob_file.fileno()).st_size:
+                    self.map = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+def blob_index_build(path):
+    index, offset = {}, 0
+
+    try:
+        with open(path, "rb") as blob_file:
+            size = os.fstat(blob_file.fileno()).st_size
+
+            while offset + HEADER.size <= size:
+                digest, length = HEADER.unpack(blob_file.read(HEADER.size))
+
+                if offset + HEADER.size + length > size:
+                    break
+
+                index[digest] = offset + HEADER.size
+                offset += HEADER.size + length
+                blob_file.seek(offset)
+    except FileNotFoundError:
+        return index
+
+    if offset < size:
+        logger.warning("Ignoring an incomplete record at the end of {}", path)
+
+    return index
+
+
+def blob_store():
+    path = os.environ.get("BLOB_PATH", BLOB_PATH_DEFAULT)
+
+    if path not in _store_list:
+        _store_list[path] = BlobStore(path)
+
+    return _store_list[path]
+
+
+def blob_reset():
+    # removed rather than truncated, processes that still map it keep reading the
+    # content they mapped
+    path = os.environ.get("BLOB_PATH", BLOB_PATH_DEFAULT)
+
+    if path in _store_list:
+        _store_list.pop(path).close()
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def blob_offload(attributes):
+    # large text is kept aside, the node only refers to where it is in the blob file
+    return {
+        key: (
+            {KEY_BLOB: blob_store().append(value)}
+            if key in BLOB_ATTRIBUTES and isinstance(value, str)
+            else value
+        )
+        for key, value in attributes.items()
+    }
+
+
+def blob_resolve(attributes):
+    return {key: blob_get(value) for key, value in attributes.items()}
+
+
+def blob_get(value):
+    if isinstance(value, dict) and KEY_BLOB in value:
+        return blob_store().read(value[KEY_BLOB])
+
+    return value
@@ -0,0 +1,491 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import random
+import shutil
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+
+import aiohttp
+import click
+import ijson
+import ujson
+from loguru import logger
+
+from popit_relationship.common import file_replace
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Client:
+    def __init__(self, session, throttle, cache_path=None, offline=False):
+        self.session = session
+        self.throttle = throttle
+        self.cache_path = cache_path
+        self.offline = offline
+
+    async def get_json(self, url, params, keep=None):
+        key = response_cache_key(url, params)
+        meta = response_cache_meta(self.cache_path, key) if self.cache_path else None
+
+        if self.offline:
+            if meta is None:
+                raise click.ClickException(
+                    f"{url}?{urlencode(params)} is not in the response cache"
+                )
+
+            click.echo(f"Replaying from cache {url}?{urlencode(params)}")
+
+            return response_cache_decode(self.cache_path, key, keep)
+
+        for attempt in range(int(os.environ.get("CRAWL_RETRIES", 5)) + 1):
+            try:
+                return await self.get_decoded(url, params, key, meta, keep)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if not error_is_transient(error) or attempt == int(
+                    os.environ.get("CRAWL_RETRIES", 5)
+                ):
+                    raise
+
+                delay = max(backoff_get(attempt), getattr(error, "retry_after", 0))
+
+                logger.warning(
+                    "Retrying {}?{} in {:.1f}s after {}",
+                    url,
+                    urlencode(params),
+                    delay,
+                    error,
+                )
+
+                await asyncio.sleep(delay)
+
+    async def get_decoded(self, url, params, key, meta, keep):
+        loop = asyncio.get_running_loop()
+
+        async with self.throttle:
+            started = loop.time()
+
+            async with self.session.get(
+                url, params=params, headers=response_cache_headers(meta)
+            ) as response:
+                click.echo(
+                    f"Fetching from {response.url} ({self.throttle.rate_describe()})"
+                )
+
+                if response.status == 429 or response.status >= 500:
+                    retry_after = retry_after_get(response.headers)
+
+                    self.throttle.slow_down(retry_after)
+
+                    raise ResponseTransientError(
+                        response.request_info,
+                        response.history,
+                        status=response.status,
+                        message=response.reason,
+                        headers=response.headers,
+                        retry_after=retry_after,
+                    )
+
+                self.throttle.speed_up(loop.time() - started)
+
+                if response.status == 304 and meta:
+                    return response_cache_decode(self.cache_path, key, keep)
+
+                response.raise_for_status()
+
+                # the body is decoded and written to the cache as it streams in
+                decoder = PageDecoder(keep)
+
+                with response_cache_open(
+                    self.cache_path,
+                    key,
+                    {
+                        "url": url,
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    },
+                ) as cache_file:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        decoder.feed(chunk)
+
+                        if cache_file:
+                            cache_file.write(chunk)
+
+                    return decoder.close()
+
+
+class PageDecoder:
+    # fed with a page as it streams in, the fields of items that are not kept are
+    # skipped over by the parser without ever being built
+    def __init__(self, keep=None):
+        self.keep = keep
+        self.event_list = ijson.sendable_list()
+        self.parser = ijson.basic_parse_coro(self.event_list, use_float=True)
+        self.root = {}
+        self.depth = 0
+        self.key = self.field = self.item = None
+        # where the value being read goes, with no builder when it is skipped
+        self.target = self.builder = None
+
+    def feed(self, chunk):
+        self.parser.send(chunk)
+        self.event_list_read()
+
+    def close(self):
+        self.parser.close()
+        self.event_list_read()
+
+        return self.root["page"]
+
+    def event_list_read(self):
+        for event, value in self.event_list:
+            self.event(event, value)
+
+        del self.event_list[:]
+
+    def event(self, event, value):
+        if self.target is None:
+            if event == "map_key":
+                if self.depth == 1:
+                    self.key = value
+                else:
+                    self.field = value
+
+                return
+            elif event == "end_map" or event == "end_array":
+                self.depth -= 1
+
+                return
+            elif self.container_open(event):
+                self.depth += 1
+
+                return
+
+            self.value_open()
+
+        if event == "start_map" or event == "start_array":
+            self.depth += 1
+        elif event == "end_map" or event == "end_array":
+            self.depth -= 1
+
+        if self.builder is not None:
+            self.builder.event(event, value)
+
+        # the value is complete once the parser is back where it started
+        if self.depth == self.target[0]:
+            if self.builder is not None:
+                _depth, container, key = self.target
+
+                if key is None:
+                    container.append(self.builder.value)
+                else:
+                    container[key] = self.builder.value
+
+            self.target = self.builder = None
+
+    def container_open(self, event):
+        # only the page, its items and the items kept in part are read field by
+        # field, anything else is built or skipped as a whole
+        if self.depth == 0 and event == "start_map":
+            self.root["page"] = {}
+        elif self.depth == 1 and self.key == "items" and event == "start_array":
+            self.root["page"]["items"] = []
+        elif self.depth == 2 and self.keep is not None and event == "start_map":
+            self.item = {}
+            self.root["page"]["items"].append(self.item)
+        else:
+            return False
+
+        return True
+
+    def value_open(self):
+        if self.depth == 0:
+            self.target = (0, self.root, "page")
+        elif self.depth == 1:
+            self.target = (1, self.root["page"], self.key)
+        elif self.depth == 2:
+            self.target = (2, self.root["page"]["items"], None)
+        else:
+            self.target = (3, self.item, self.field)
+
+            if self.field not in self.keep:
+                return
+
+        self.builder = ijson.ObjectBuilder()
+
+
+class ResponseTransientError(aiohttp.ClientResponseError):
+    def __init__(self, *args, retry_after=0, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+
+        self.updated = now
+
+    def pause(self, seconds):
+        self.paused_until = max(
+            self.paused_until, asyncio.get_running_loop().time() + seconds
+        )
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+
+        async with self._lock:
+            while loop.time() < self.paused_until:
+                await asyncio.sleep(self.paused_until - loop.time())
+
+            if not self.rate:
+                return
+
+            self._refill(loop.time())
+
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill(loop.time())
+
+            self.tokens -= 1
+
+
+class Throttle:
+    def __init__(
+        self,
+        concurrency,
+        rate,
+        burst=1,
+        rate_min=None,
+        rate_max=None,
+        rate_step=None,
+        latency_target=2.0,
+    ):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.rate_min = rate_min if rate_min is not None else rate / 10
+        self.rate_max = rate_max if rate_max is not None else rate * 4
+        self.rate_step = rate_step if rate_step is not None else rate / 10
+        self.latency_target = latency_target
+        self.slowed = None
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+        return self
+
+    async def __aexit__(self, *_exc):
+        self.semaphore.release()
+
+    def rate_describe(self):
+        return f"{self.bucket.rate:.2f} requests/s" if self.bucket.rate else "unlimited"
+
+    # additive increase, multiplicative decrease: the rate creeps up while the API
+    # responds quickly, and is halved on slow responses, 429 and 5xx
+    def speed_up(self, latency):
+        if latency > self.latency_target:
+            self.slow_down()
+        elif self.bucket.rate:
+            self.bucket.rate = min(self.rate_max, self.bucket.rate + self.rate_step)
+
+    def slow_down(self, retry_after=0):
+        now = asyncio.get_running_loop().time()
+
+        if retry_after:
+            self.bucket.pause(retry_after)
+
+        # requests already in flight report the same congestion, only react once
+        if self.bucket.rate and (
+            self.slowed is None or now - self.slowed > self.latency_target
+        ):
+            self.slowed = now
+            self.bucket.rate = max(self.rate_min, self.bucket.rate / 2)
+
+            logger.info("Crawl rate lowered to {}", self.rate_describe())
+
+
+def rate_get():
+    # CRAWL_INTERVAL is kept as a fallback for existing .env files
+    if os.environ.get("CRAWL_RATE", False):
+        return float(os.environ["CRAWL_RATE"])
+
+    interval = float(os.environ.get("CRAWL_INTERVAL", 1))
+
+    return 1 / interval if interval > 0 else 0
+
+
+def throttle_init():
+    return Throttle(
+        int(os.environ.get("CRAWL_CONCURRENCY", 4)),
+        rate_get(),
+        int(os.environ.get("CRAWL_BURST", 1)),
+        *(
+            float(os.environ[key]) if os.environ.get(key, False) else None
+            for key in ("CRAWL_RATE_MIN", "CRAWL_RATE_MAX", "CRAWL_RATE_STEP")
+        ),
+        float(os.environ.get("CRAWL_LATENCY_TARGET", 2)),
+    )
+
+
+def backoff_get(attempt):
+    return random.uniform(
+        0,
+        min(
+            float(os.environ.get("CRAWL_BACKOFF_MAX", 60)),
+            float(os.environ.get("CRAWL_BACKOFF", 1)) * 2**attempt,
+        ),
+    )
+
+
+def error_is_transient(error):
+    return not isinstance(error, aiohttp.ClientResponseError) or isinstance(
+        error, ResponseTransientError
+    )
+
+
+def retry_after_get(headers):
+    value = headers.get("Retry-After")
+
+    if not value:
+        return 0
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(
+            0,
+            (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(),
+        )
+    except (TypeError, ValueError):
+        return 0
+
+
+@asynccontextmanager
+async def client_start(offline=False):
+    # a development aid, only written when asked for, and replayed from offline
+    cache_path = os.environ.get("HTTP_CACHE_PATH", None) or None
+
+    if offline and not cache_path:
+        raise click.ClickException("--offline replays from HTTP_CACHE_PATH, set it")
+
+    throttle = throttle_init()
+
+    async with session_start_http(throttle.concurrency) as session:
+        yield Client(session, throttle, cache_path, offline)
+
+
+def response_cache_headers(meta):
+    return dict(
+        {"If-None-Match": meta["etag"]} if meta and meta.get("etag") else {},
+        **(
+            {"If-Modified-Since": meta["last_modified"]}
+            if meta and meta.get("last_modified")
+            else {}
+        ),
+    )
+
+
+def response_cache_key(url, params):
+    query = urlencode(sorted(params.items() if isinstance(params, dict) else params))
+
+    return hashlib.sha256(f"{url}?{query}".encode("utf-8")).hexdigest()
+
+
+def response_cache_clear():
+    if os.environ.get("HTTP_CACHE_PATH", False):
+        shutil.rmtree(os.environ["HTTP_CACHE_PATH"], ignore_errors=True)
+
+
+def response_cache_decode(cache_path, key, keep=None):
+    decoder = PageDecoder(keep)
+
+    with gzip.open(response_cache_path(cache_path, key)) as cache_file:
+        cache_file.readline()
+
+        for chunk in iter(lambda: cache_file.read(CHUNK_SIZE), b""):
+            decoder.feed(chunk)
+
+    return decoder.close()
+
+
+def response_cache_meta(cache_path, key):
+    try:
+        with gzip.open(response_cache_path(cache_path, key)) as cache_file:
+            return ujson.loads(cache_file.readline())
+    except (FileNotFoundError, EOFError, OSError, ValueError):
+        return None
+
+
+@contextmanager
+def response_cache_open(cache_path, key, meta):
+    if not cache_path:
+        yield None
+        return
+
+    path = response_cache_path(cache_path, key)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with file_replace(path) as path_tmp, gzip.open(path_tmp, "wb") as cache_file:
+        cache_file.write(ujson.dumps(meta).encode("utf-8") + b"\n")
+
+        yield cache_file
+
+
+def response_cache_path(cache_path, key):
+    return os.path.join(cache_path, key[:2], f"{key}.gz")
+
+
+def page_decode(body, keep=None):
+    decoder = PageDecoder(keep)
+    decoder.feed(body)
+
+    return decoder.close()
+
+
+def session_start_http(concurrency=None):
+    # many small requests to a single host, so keep connections alive and reuse them
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=concurrency or 100,
+            limit_per_host=concurrency or 0,
+            keepalive_timeout=float(os.environ.get("CRAWL_KEEPALIVE", 60)),
+            ttl_dns_cache=300,
+        ),
+        timeout=aiohttp.ClientTimeout(total=float(os.environ.get("CRAWL_TIMEOUT", 60))),
+        headers={"Accept": "application/json"},
+        json_serialize=ujson.dumps,
+        auth=(
+            aiohttp.BasicAuth(
+                os.environ["API_AUTH_USER"], os.environ.get("API_AUTH_PASS", None)
+            )
+            if os.environ.get("API_AUTH_USER", False)
+            else None
+        ),
+    )
@@ -1,13 +1,15 @@
 import asyncio
 import os
+from contextlib import contextmanager
 from functools import wraps
 
-import networkx as nx
-from networkx.exception import NetworkXError
+import ujson
 
-CACHE_PATH_DEFAULT = "./primport-cache.gpickle"
+STATE_PATH_DEFAULT = "./primport-state.json"
 KEY_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
 KEY_RELATIONSHIP = "http://purl.org/vocab/relationship/Relationship"
+KEY_OWNERSHIP = "https://sinarproject.org/ns/ownership#ownershipOrControlStatement"
+KEY_INDEX_TYPE = "node_type"
 
 
 def coro(f):
@@ -18,36 +20,71 @@ def coro(f):
     return wrapper
 
 
-def graph_init():
+def state_load():
     try:
-        return nx.read_gpickle(os.environ.get("CACHE_PATH", CACHE_PATH_DEFAULT))
+        with open(os.environ.get("STATE_PATH", STATE_PATH_DEFAULT)) as state_file:
+            return ujson.load(state_file)
     except FileNotFoundError:
-        graph = nx.MultiDiGraph()
-        graph_save(graph)
+        return {}
 
-        return graph
 
+def state_save(state):
+    path = os.environ.get("STATE_PATH", STATE_PATH_DEFAULT)
+
+    with file_replace(path) as path_tmp, open(path_tmp, "w") as state_file:
+        ujson.dump(state, state_file, indent=2)
+
+
+@contextmanager
+def file_replace(path):
+    # written aside then renamed, so that readers, and other processes writing the
+    # same file, only ever see it complete
+    path_tmp = f"{path}.{os.getpid()}.tmp"
 
-def graph_prune(graph, node_type):
     try:
-        for source in graph.predecessors(node_type):
-            for dest in graph.successors(source):
-                for key, _ in graph.succ[source][dest].items():
-                    graph.remove_edges_from((source, dest, key))
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+
+        yield path_tmp
 
-            if graph.in_degree(source) == 0:
-                graph.remove_node(source)
+        os.replace(path_tmp, path)
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
 
-    except NetworkXError:
-        pass
 
+def node_prune(graph, node):
+    graph.remove_edges_from(list(graph.out_edges(node, keys=True)))
+    node_type_index(graph).pop(node, None)
 
-def graph_save(graph):
-    return nx.write_gpickle(graph, os.environ.get("CACHE_PATH", CACHE_PATH_DEFAULT))
+    if graph.in_degree(node) == 0:
+        graph.remove_node(node)
+    else:
+        graph.nodes[node].clear()
 
 
 def node_get_type(graph, node):
-    try:
-        return [j for i, j, k in graph.edges if i == node and k == KEY_TYPE][0]
-    except IndexError:
-        return False
+    return node_type_index(graph).get(node, False)
+
+
+def node_get_name(graph, node):
+    data = graph.nodes[node] if node in graph else {}
+
+    return data.get("name", data.get("label", None))
+
+
+def node_set_type(graph, node, node_type):
+    node_type_index(graph).setdefault(node, node_type)
+
+
+def node_type_index(graph):
+    # kept in the graph attributes so that it is pickled along with the cache, caches
+    # written before the index existed get it built on first use
+    if KEY_INDEX_TYPE not in graph.graph:
+        graph.graph[KEY_INDEX_TYPE] = {}
+
+        for source, dest, key in graph.edges(keys=True):
+            if key == KEY_TYPE:
+                graph.graph[KEY_INDEX_TYPE].setdefault(source, dest)
+
+    return graph.graph[KEY_INDEX_TYPE]
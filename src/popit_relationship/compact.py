@@ -0,0 +1,242 @@
+import networkx as nx
+import numpy as np
+
+from popit_relationship.common import node_type_index
+
+
+class CompactGraph:
+    # node ids and predicates are interned to integers, and the edges of every
+    # predicate are kept as CSR arrays in both directions. Predicates are interned
+    # along with the uri relationships keep their precise predicate in, so that
+    # either can be followed, as with a graph
+    def __init__(
+        self,
+        node_list,
+        predicate_list,
+        source,
+        dest,
+        code,
+        node_data,
+        node_type,
+        edge_data,
+    ):
+        self.node_list = node_list
+        self.node_index = {node: index for index, node in enumerate(node_list)}
+        self.predicate_list = predicate_list
+        self.node_data = node_data
+        self.node_type = node_type
+        self.edge_data = {}
+        self.successor_list = {}
+        self.predecessor_list = {}
+
+        for predicate in range(len(predicate_list)):
+            mask = code == predicate
+
+            self.successor_list[predicate], order = csr_build(
+                source[mask], dest[mask], len(node_list)
+            )
+            self.predecessor_list[predicate], _order = csr_build(
+                dest[mask], source[mask], len(node_list)
+            )
+
+            # edge attributes are rare, so only those that exist are kept, by their
+            # position in the successor arrays
+            self.edge_data[predicate] = {
+                position: edge_data[index]
+                for position, index in enumerate(np.flatnonzero(mask)[order])
+                if edge_data[index]
+            }
+
+    def number_of_nodes(self):
+        return len(self.node_list)
+
+    def number_of_edges(self):
+        return sum(len(indices) for _indptr, indices in self.successor_list.values())
+
+    def node_code(self, node):
+        return self.node_index[node]
+
+    def predicate_code_list(self, predicate_list=None):
+        if predicate_list is None:
+            return list(range(len(self.predicate_list)))
+
+        return [
+            index
+            for index, (key, uri) in enumerate(self.predicate_list)
+            if key in predicate_list or uri in predicate_list
+        ]
+
+    def successors(self, node, predicate_list=None):
+        return csr_neighbours(
+            self.successor_list, node, self.predicate_code_list(predicate_list)
+        )
+
+    def predecessors(self, node, predicate_list=None):
+        return csr_neighbours(
+            self.predecessor_list, node, self.predicate_code_list(predicate_list)
+        )
+
+    def neighbours(self, node, predicate_list=None):
+        return np.unique(
+            np.concatenate(
+                (
+                    self.successors(node, predicate_list),
+                    self.predecessors(node, predicate_list),
+                )
+            )
+        )
+
+    def degree(self, predicate_list=None):
+        result = np.zeros(len(self.node_list), dtype=np.int64)
+
+        for predicate in self.predicate_code_list(predicate_list):
+            result += np.diff(self.successor_list[predicate][0])
+            result += np.diff(self.predecessor_list[predicate][0])
+
+        return result
+
+
+def csr_build(source, dest, size):
+    order = np.argsort(source, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+
+    np.cumsum(np.bincount(source, minlength=size), out=indptr[1:])
+
+    return (indptr, dest[order]), order
+
+
+def csr_neighbours(csr_list, node, predicate_list):
+    if not predicate_list:
+        return np.empty(0, dtype=np.int32)
+
+    return np.concatenate(
+        [
+            csr_list[predicate][1][
+                csr_list[predicate][0][node] : csr_list[predicate][0][node + 1]
+            ]
+            for predicate in predicate_list
+        ]
+    )
+
+
+def compact_build(graph):
+    # in order, so that nodes are visited in the same order as in the graph
+    node_list = sorted(graph.nodes)
+    node_index = {node: index for index, node in enumerate(node_list)}
+    edge_list = list(graph.edges(keys=True, data=True))
+    predicate_list = sorted(
+        set((key, data.get("uri", None)) for _source, _dest, key, data in edge_list),
+        key=lambda predicate: (predicate[0], predicate[1] or ""),
+    )
+    predicate_index = {
+        predicate: index for index, predicate in enumerate(predicate_list)
+    }
+    node_type = np.full(len(node_list), -1, dtype=np.int32)
+
+    for node, type_node in node_type_index(graph).items():
+        if node in node_index and type_node in node_index:
+            node_type[node_index[node]] = node_index[type_node]
+
+    return CompactGraph(
+        node_list,
+        predicate_list,
+        np.fromiter(
+            (node_index[source] for source, _dest, _key, _data in edge_list),
+            dtype=np.int32,
+            count=len(edge_list),
+        ),
+        np.fromiter(
+            (node_index[dest] for _source, dest, _key, _data in edge_list),
+            dtype=np.int32,
+            count=len(edge_list),
+        ),
+        np.fromiter(
+            (
+                predicate_index[(key, data.get("uri", None))]
+                for _source, _dest, key, data in edge_list
+            ),
+            dtype=np.int32,
+            count=len(edge_list),
+        ),
+        [graph.nodes[node] or None for node in node_list],
+        node_type,
+        [data for _source, _dest, _key, data in edge_list],
+    )
+
+
+def compact_subgraph(compact, node_list):
+    # the few nodes a query returns, with their types and every edge they are an end
+    # of, read back from the arrays rather than kept in a graph next to them
+    graph = nx.MultiDiGraph()
+    index = node_type_index(graph)
+    code_list = [
+        compact.node_code(node) for node in node_list if node in compact.node_index
+    ]
+
+    for node in code_list:
+        graph.add_node(compact.node_list[node], **(compact.node_data[node] or {}))
+
+        if compact.node_type[node] >= 0:
+            index[compact.node_list[node]] = compact.node_list[compact.node_type[node]]
+
+    for node in code_list:
+        for predicate, (indptr, indices) in compact.successor_list.items():
+            for position in range(indptr[node], indptr[node + 1]):
+                edge_add(graph, compact, predicate, node, indices[position], position)
+
+    for node in code_list:
+        for predicate, (indptr, indices) in compact.predecessor_list.items():
+            successor_indptr, successor_indices = compact.successor_list[predicate]
+
+            for source in indices[indptr[node] : indptr[node + 1]]:
+                for position in range(
+                    successor_indptr[source], successor_indptr[source + 1]
+                ):
+                    if successor_indices[position] == node:
+                        edge_add(graph, compact, predicate, source, node, position)
+
+    return graph
+
+
+def edge_add(graph, compact, predicate, source, dest, position):
+    graph.add_edge(
+        compact.node_list[source],
+        compact.node_list[dest],
+        key=compact.predicate_list[predicate][0],
+        **compact.edge_data[predicate].get(position, {}),
+    )
+
+
+def compact_to_graph(compact):
+    graph = nx.MultiDiGraph()
+    index = node_type_index(graph)
+
+    for node, data in zip(compact.node_list, compact.node_data):
+        graph.add_node(node, **(data or {}))
+
+    for node, node_type in zip(compact.node_list, compact.node_type):
+        if node_type >= 0:
+            index[node] = compact.node_list[node_type]
+
+    for predicate in compact.predicate_code_list():
+        edge_list_add(graph, compact, predicate)
+
+    return graph
+
+
+def compact_predicate_graph(compact, predicate_list):
+    # just the edges of some predicates, e.g. to follow ownership without the rest
+    graph = nx.MultiDiGraph()
+
+    for predicate in compact.predicate_code_list(predicate_list):
+        edge_list_add(graph, compact, predicate)
+
+    return graph
+
+
+def edge_list_add(graph, compact, predicate):
+    indptr, indices = compact.successor_list[predicate]
+    source_list = np.repeat(np.arange(len(compact.node_list)), np.diff(indptr))
+
+    for position, (source, dest) in enumerate(zip(source_list, indices)):
+        edge_add(graph, compact, predicate, source, dest, position)
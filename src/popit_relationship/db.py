@@ -1,9 +1,19 @@
+import hashlib
 import os
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlsplit
 
+import ujson
+from loguru import logger
 from neo4j import GraphDatabase
 
-from popit_relationship.common import KEY_TYPE, node_get_type
+from popit_relationship.blob import blob_resolve
+from popit_relationship.common import KEY_TYPE, file_replace, node_get_type
+
+NEO4J_SNAPSHOT_PATH_DEFAULT = "./primport-neo4j-snapshot.json"
 
 
 def driver_init():
@@ -13,72 +23,368 @@ def driver_init():
     )
 
 
-def graph_save(tx, graph):
-    for node, dest, key in graph.edges:
-        node_save(tx, graph, node)
+def graph_save(driver, graph, full=False, workers=1):
+    node_batch, relationship_batch = batch_build(graph)
 
-        if not key == KEY_TYPE:
-            node_save(tx, graph, dest)
+    # only what changed since the last save is written, unless a full save is asked
+    snapshot = snapshot_build(node_batch, relationship_batch)
+    previous = snapshot_empty() if full else snapshot_load()
 
-            node_save_relationship(tx, graph, node, dest, key)
+    with driver.session() as session:
+        schema_init(session, [label for label in node_batch if label])
 
+    node_delete, relationship_delete = snapshot_diff_delete(previous, snapshot)
 
-def node_save(tx, graph, node):
-    if node_get_type(graph, node):
-        tx.run(
-            f"MERGE (node:{urlsplit(node_get_type(graph, node)).fragment} {{id: $id}})",
-            id=node,
-        )
+    # every phase is done before the next starts, so that nodes are all committed
+    # before the relationships that look them up
+    phase_run(
+        driver,
+        "relationship deletes",
+        relationship_partition(relationship_delete, relationship_delete_batch, workers),
+        workers,
+    )
+    phase_run(
+        driver,
+        "node deletes",
+        node_partition(node_delete, node_delete_batch, workers),
+        workers,
+    )
+    phase_run(
+        driver,
+        "node writes",
+        node_partition(
+            batch_filter(
+                node_batch,
+                lambda row: previous["nodes"].get(row["id"])
+                != snapshot["nodes"][row["id"]],
+            ),
+            node_save_batch,
+            workers,
+        ),
+        workers,
+    )
+    phase_run(
+        driver,
+        "relationship writes",
+        relationship_partition(
+            batch_filter(
+                relationship_batch,
+                lambda row: previous["relationships"].get(relationship_get_key(row))
+                != snapshot["relationships"][relationship_get_key(row)],
+            ),
+            relationship_save_batch,
+            workers,
+        ),
+        workers,
+    )
 
-        tx.run(
-            f"""
-            MATCH (node:{urlsplit(node_get_type(graph, node)).fragment} {{id: $id}})
-            SET node = $attributes
-            """,
-            id=node,
-            attributes=dict(graph.nodes[node]),
+    snapshot_save(snapshot)
+
+
+def node_partition(batch, function, workers):
+    # nodes are unique, so chunks can be spread over the workers in any order
+    partition_list = [[] for _ in range(workers)]
+
+    for label, row_list in batch.items():
+        for index, chunk in enumerate(chunk_split(row_list)):
+            partition_list[index % workers].append((function, (label,), chunk))
+
+    return partition_list
+
+
+def relationship_partition(batch, function, workers):
+    # relationships from the same source stay in the same partition, so that two
+    # workers never contend for the lock on it. Their destinations are still locked
+    # too, and may be shared between workers: the deadlocks that follow are transient
+    # errors, retried by write_transaction
+    partition_list = [[] for _ in range(workers)]
+
+    for group, row_list in batch.items():
+        split = [[] for _ in range(workers)]
+
+        for row in row_list:
+            split[zlib.crc32(row["source"].encode("utf-8")) % workers].append(row)
+
+        for index, row_list_split in enumerate(split):
+            partition_list[index].extend(
+                (function, group, chunk) for chunk in chunk_split(row_list_split)
+            )
+
+    return partition_list
+
+
+def partition_run(driver, partition):
+    started, count = time.monotonic(), 0
+
+    with driver.session() as session:
+        for function, args, chunk in partition:
+            session.write_transaction(function, *args, chunk)
+            count += len(chunk)
+
+    return count, time.monotonic() - started
+
+
+def phase_run(driver, name, partition_list, workers):
+    partition_list = [partition for partition in partition_list if partition]
+
+    if not partition_list:
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        result = list(
+            executor.map(
+                lambda partition: partition_run(driver, partition), partition_list
+            )
         )
-    else:
-        tx.run(
-            """
-            MERGE (node {id: $id})
-            """,
-            id=node,
+
+    for index, (count, elapsed) in enumerate(result):
+        logger.info(
+            "{} worker {}: {} rows in {:.1f}s ({:.0f} rows/s)",
+            name.capitalize(),
+            index,
+            count,
+            elapsed,
+            count / elapsed if elapsed else count,
         )
 
 
-def node_save_relationship(tx, graph, node, dest, key):
-    data = graph.get_edge_data(node, dest, key)
-    if data:
-        predicate = data.get("uri", key)
+def batch_build(graph):
+    relationship_batch = defaultdict(list)
+
+    for node, dest, key, data in graph.edges(keys=True, data=True):
+        if not key == KEY_TYPE:
+            relationship_batch[
+                (
+                    arrow_get_type(data.get("uri", key)),
+                    node_get_label(graph, node),
+                    node_get_label(graph, dest),
+                )
+            ].append(relationship_row_build(node, dest, key, data))
+
+    node_batch = defaultdict(list)
+
+    for node in graph_node_list(graph):
+        node_batch[node_get_label(graph, node)].append(node_row_build(graph, node))
+
+    return node_batch, relationship_batch
+
+
+def graph_node_list(graph):
+    # class nodes are only ever the object of a type statement, and become labels
+    node_list = set()
+
+    for node, dest, key in graph.edges(keys=True):
+        node_list.add(node)
+
+        if not key == KEY_TYPE:
+            node_list.add(dest)
+
+    return node_list
+
+
+def batch_filter(batch, predicate):
+    result = {}
+
+    for group, row_list in batch.items():
+        row_list = [row for row in row_list if predicate(row)]
+
+        if row_list:
+            result[group] = row_list
+
+    return result
+
 
+def chunk_split(row_list):
+    size = int(os.environ.get("NEO4J_BATCH_SIZE", 1000))
+
+    return (row_list[i : i + size] for i in range(0, len(row_list), size))
+
+
+def node_get_label(graph, node):
+    node_type = node_get_type(graph, node)
+
+    return urlsplit(node_type).fragment if node_type else None
+
+
+def node_delete_batch(tx, label, row_list):
+    tx.run(
+        f"""
+        UNWIND $rows AS row
+        MATCH (node{label_format(label)} {{id: row.id}})
+        DETACH DELETE node
+        """,
+        rows=row_list,
+    )
+
+
+def node_row_build(graph, node):
+    return {"id": node, "attributes": dict(graph.nodes[node], id=node)}
+
+
+def node_save_batch(tx, label, row_list):
+    if label:
+        # the snapshot only compares blob references, the text is read just for
+        # the nodes that are written
         tx.run(
             f"""
-            MATCH (source {{id: $source_id}})
-            MATCH (dest {{id: $dest_id}})
-            MERGE (source)
-                -[rel:{arrow_get_type(predicate)}
-                    {{predicate: $predicate, key: $key, {(', ').join('data_{key}: $data_{key}'.format(key=data_key) for data_key, value in data.items() if value)}}}]->
-                (dest)
+            UNWIND $rows AS row
+            MERGE (node:{label} {{id: row.id}})
+            SET node = row.attributes
             """,
-            source_id=node,
-            dest_id=dest,
-            predicate=predicate,
-            key=key,
-            **{f"data_{key}": value for key, value in data.items() if value},
+            rows=[
+                dict(row, attributes=blob_resolve(row["attributes"]))
+                for row in row_list
+            ],
         )
     else:
         tx.run(
-            f"""
-            MATCH (source {{id: $source_id}})
-            MATCH (dest {{id: $dest_id}})
-            MERGE (source)-[rel:{arrow_get_type(key)} {{predicate: $key, key: $key}}]->(dest)
+            """
+            UNWIND $rows AS row
+            MERGE (node {id: row.id})
             """,
-            source_id=node,
-            dest_id=dest,
-            key=key,
+            rows=row_list,
         )
 
 
+def relationship_delete_batch(tx, rel_type, source_label, dest_label, row_list):
+    tx.run(
+        f"""
+        UNWIND $rows AS row
+        MATCH (source{label_format(source_label)} {{id: row.source}})
+            -[rel:{rel_type} {{key: row.key}}]->
+            (dest{label_format(dest_label)} {{id: row.dest}})
+        DELETE rel
+        """,
+        rows=row_list,
+    )
+
+
+def relationship_get_key(row):
+    return "\t".join((row["source"], row["dest"], row["key"]))
+
+
+def relationship_row_build(node, dest, key, data):
+    return {
+        "source": node,
+        "dest": dest,
+        "predicate": data.get("uri", key),
+        "key": key,
+        "data": {
+            f"data_{data_key}": value for data_key, value in data.items() if value
+        },
+    }
+
+
+def relationship_save_batch(tx, rel_type, source_label, dest_label, row_list):
+    # matching with the label lets both ends be looked up through the id constraint
+    tx.run(
+        f"""
+        UNWIND $rows AS row
+        MATCH (source{label_format(source_label)} {{id: row.source}})
+        MATCH (dest{label_format(dest_label)} {{id: row.dest}})
+        MERGE (source)
+            -[rel:{rel_type} {{predicate: row.predicate, key: row.key}}]->
+            (dest)
+        SET rel = row.data, rel.predicate = row.predicate, rel.key = row.key
+        """,
+        rows=row_list,
+    )
+
+
+def label_format(label):
+    return f":{label}" if label else ""
+
+
+def schema_init(session, label_list):
+    for label in label_list:
+        session.write_transaction(constraint_create, label)
+
+
+def constraint_create(tx, label):
+    tx.run(f"""
+        CREATE CONSTRAINT {label}_id IF NOT EXISTS
+        ON (node:{label}) ASSERT node.id IS UNIQUE
+        """)
+
+
+def snapshot_build(node_batch, relationship_batch):
+    return {
+        "nodes": {
+            row["id"]: [label, snapshot_hash(row["attributes"])]
+            for label, row_list in node_batch.items()
+            for row in row_list
+        },
+        "relationships": {
+            relationship_get_key(row): [
+                rel_type,
+                source_label,
+                dest_label,
+                snapshot_hash([row["predicate"], row["data"]]),
+            ]
+            for (rel_type, source_label, dest_label), row_list in (
+                relationship_batch.items()
+            )
+            for row in row_list
+        },
+    }
+
+
+def snapshot_diff_delete(previous, snapshot):
+    # a node or relationship whose label or type changed is deleted and written anew
+    node_delete, relationship_delete = defaultdict(list), defaultdict(list)
+
+    for node, (label, _hash) in previous["nodes"].items():
+        current = snapshot["nodes"].get(node, None)
+
+        if current is None or current[0] != label:
+            node_delete[label].append({"id": node})
+
+    for key, value in previous["relationships"].items():
+        current = snapshot["relationships"].get(key, None)
+
+        if current is None or current[:3] != value[:3]:
+            source, dest, rel_key = key.split("\t")
+
+            relationship_delete[tuple(value[:3])].append(
+                {"source": source, "dest": dest, "key": rel_key}
+            )
+
+    return node_delete, relationship_delete
+
+
+def snapshot_empty():
+    return {"nodes": {}, "relationships": {}}
+
+
+def snapshot_hash(value):
+    return hashlib.blake2b(
+        ujson.dumps(value, sort_keys=True).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def snapshot_load():
+    try:
+        with open(
+            os.environ.get("NEO4J_SNAPSHOT_PATH", NEO4J_SNAPSHOT_PATH_DEFAULT)
+        ) as snapshot_file:
+            return ujson.load(snapshot_file)
+    except FileNotFoundError:
+        return snapshot_empty()
+
+
+def snapshot_save(snapshot):
+    path = os.environ.get("NEO4J_SNAPSHOT_PATH", NEO4J_SNAPSHOT_PATH_DEFAULT)
+
+    with file_replace(path) as path_tmp, open(path_tmp, "w") as snapshot_file:
+        ujson.dump(snapshot, snapshot_file)
+
+
+def snapshot_reset():
+    try:
+        os.remove(os.environ.get("NEO4J_SNAPSHOT_PATH", NEO4J_SNAPSHOT_PATH_DEFAULT))
+    except FileNotFoundError:
+        pass
+
+
 def arrow_get_type(uri):
     return urlsplit(uri).fragment or urlsplit(uri).path.split("/")[-1]
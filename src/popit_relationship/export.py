@@ -0,0 +1,266 @@
+import csv
+import hashlib
+import os
+import re
+from collections import defaultdict
+from contextlib import ExitStack
+
+import click
+import ujson
+
+from popit_relationship.analyze import METRIC_LIST
+from popit_relationship.blob import blob_resolve
+from popit_relationship.common import KEY_TYPE
+from popit_relationship.db import (
+    arrow_get_type,
+    graph_node_list,
+    node_get_label,
+    node_row_build,
+    relationship_row_build,
+)
+from popit_relationship.store import graph_init, store_open
+
+# node and edge attributes are written as triples with predicates in this namespace
+ATTRIBUTE_NS = "https://sinarproject.org/ns/popit#"
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XSD_NS = "http://www.w3.org/2001/XMLSchema#"
+
+LITERAL_ESCAPE = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"}
+# characters not allowed in an IRIREF are written as UCHAR escapes
+IRI_ESCAPE = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+
+@click.group()
+def export():
+    pass
+
+
+@export.command("neo4j-csv")
+@click.argument("directory", type=click.Path(file_okay=False))
+def neo4j_csv(directory):
+    graph = graph_init()
+
+    os.makedirs(directory, exist_ok=True)
+
+    node_path_list = node_csv_write(graph, directory)
+    relationship_path_list = relationship_csv_write(graph, directory)
+
+    click.echo(
+        " ".join(
+            ["neo4j-admin import --multiline-fields=true"]
+            + [f"--nodes={path}" for path in node_path_list]
+            + [f"--relationships={path}" for path in relationship_path_list]
+        )
+    )
+
+
+@export.command("jsonl")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+def jsonl(output):
+    with store_open() as connection:
+        for line in jsonl_build(connection):
+            output.write(line)
+
+
+@export.command("ntriples")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+def ntriples(output):
+    with store_open() as connection:
+        for line in ntriples_build(connection):
+            output.write(line)
+
+
+def jsonl_build(connection):
+    # one line per node and per edge, shaped as the *_build_node functions return
+    # them, and in the same order on every export
+    for node, attributes in node_row_stream(connection):
+        yield jsonl_dumps({"node": node, "attributes": attributes})
+
+    for source, dest, key, attributes in edge_row_stream(connection):
+        yield jsonl_dumps(
+            {
+                "subject": source,
+                "predicate": {"key": key, "attributes": attributes},
+                "object": dest,
+            }
+        )
+
+
+def jsonl_dumps(value):
+    return (
+        ujson.dumps(
+            value, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False
+        )
+        + "\n"
+    )
+
+
+def ntriples_build(connection):
+    for node, attributes in node_row_stream(connection):
+        for name, value in sorted(attributes.items()):
+            yield ntriple(iri(node), iri(f"{ATTRIBUTE_NS}{name}"), literal(value))
+
+    for source, dest, key, attributes in edge_row_stream(connection):
+        yield ntriple(iri(source), iri(key), iri(dest))
+
+        if not attributes:
+            continue
+
+        # edge attributes are kept on a reification of the edge, named after it so
+        # that the same edge gets the same blank node on every export
+        statement = (
+            "_:e"
+            + hashlib.blake2b(
+                "\t".join((source, key, dest)).encode("utf-8"), digest_size=16
+            ).hexdigest()
+        )
+
+        yield ntriple(statement, iri(f"{RDF_NS}type"), iri(f"{RDF_NS}Statement"))
+        yield ntriple(statement, iri(f"{RDF_NS}subject"), iri(source))
+        yield ntriple(statement, iri(f"{RDF_NS}predicate"), iri(key))
+        yield ntriple(statement, iri(f"{RDF_NS}object"), iri(dest))
+
+        for name, value in sorted(attributes.items()):
+            yield ntriple(statement, iri(f"{ATTRIBUTE_NS}{name}"), literal(value))
+
+
+def ntriple(subject, predicate, object_):
+    return f"{subject} {predicate} {object_} .\n"
+
+
+def iri(value):
+    return "<{}>".format(
+        IRI_ESCAPE.sub(lambda match: f"\\u{ord(match.group()):04X}", value)
+    )
+
+
+def literal(value):
+    if isinstance(value, bool):
+        return f'"{str(value).lower()}"^^<{XSD_NS}boolean>'
+    elif isinstance(value, int):
+        return f'"{value}"^^<{XSD_NS}integer>'
+    elif isinstance(value, float):
+        return f'"{value!r}"^^<{XSD_NS}double>'
+    elif not isinstance(value, str):
+        return '"{}"^^<{}JSON>'.format(
+            literal_escape(ujson.dumps(value, sort_keys=True)), RDF_NS
+        )
+
+    return f'"{literal_escape(value)}"'
+
+
+def literal_escape(value):
+    return "".join(LITERAL_ESCAPE.get(char, char) for char in value)
+
+
+def node_row_stream(connection):
+    # read off the primary keys as they are written out, so that the export takes
+    # the same memory however large the cache is
+    for node, attributes in connection.execute(
+        "SELECT id, attributes FROM node WHERE attributes != '{}' ORDER BY id"
+    ):
+        attributes = {
+            key: value
+            for key, value in ujson.loads(attributes).items()
+            if key not in METRIC_LIST
+        }
+
+        if attributes:
+            yield node, blob_resolve(attributes)
+
+
+def edge_row_stream(connection):
+    for source, dest, key, attributes in connection.execute(
+        "SELECT source, dest, key, attributes FROM edge ORDER BY source, dest, key"
+    ):
+        yield source, dest, key, ujson.loads(attributes)
+
+
+def node_csv_write(graph, directory):
+    node_list = defaultdict(list)
+
+    for node in graph_node_list(graph):
+        node_list[node_get_label(graph, node)].append(node)
+
+    path_list = []
+
+    for label, label_node_list in node_list.items():
+        field_list = sorted(
+            set(key for node in label_node_list for key in graph.nodes[node]) - {"id"}
+        )
+        path = os.path.join(directory, csv_name("nodes", label))
+
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["id:ID"] + field_list + ([":LABEL"] if label else []))
+
+            for node in sorted(label_node_list):
+                attributes = blob_resolve(node_row_build(graph, node)["attributes"])
+
+                writer.writerow(
+                    [node]
+                    + [csv_value(attributes.get(field)) for field in field_list]
+                    + ([label] if label else [])
+                )
+
+        path_list.append(path)
+
+    return path_list
+
+
+def relationship_csv_write(graph, directory):
+    # the first pass collects the columns of every file, the second writes the rows
+    field_list = defaultdict(set)
+
+    for _node, _dest, key, data in relationship_edge_list(graph):
+        field_list[arrow_get_type(data.get("uri", key))].update(
+            f"data_{data_key}" for data_key, value in data.items() if value
+        )
+
+    field_list = {
+        rel_type: sorted(field_set) for rel_type, field_set in field_list.items()
+    }
+    path_list = {
+        rel_type: os.path.join(directory, csv_name("relationships", rel_type))
+        for rel_type in field_list
+    }
+
+    with ExitStack() as stack:
+        writer_list = {}
+
+        for rel_type, path in path_list.items():
+            writer_list[rel_type] = csv.writer(
+                stack.enter_context(open(path, "w", newline=""))
+            )
+            writer_list[rel_type].writerow(
+                [":START_ID", ":END_ID", ":TYPE", "predicate", "key"]
+                + field_list[rel_type]
+            )
+
+        for node, dest, key, data in relationship_edge_list(graph):
+            rel_type = arrow_get_type(data.get("uri", key))
+            row = relationship_row_build(node, dest, key, data)
+
+            writer_list[rel_type].writerow(
+                [row["source"], row["dest"], rel_type, row["predicate"], row["key"]]
+                + [csv_value(row["data"].get(field)) for field in field_list[rel_type]]
+            )
+
+    return list(path_list.values())
+
+
+def relationship_edge_list(graph):
+    return (
+        (node, dest, key, data)
+        for node, dest, key, data in graph.edges(keys=True, data=True)
+        if not key == KEY_TYPE
+    )
+
+
+def csv_name(prefix, name):
+    return f"{prefix}-{name}.csv" if name else f"{prefix}.csv"
+
+
+def csv_value(value):
+    # an empty field is read as a missing property by neo4j-admin
+    return "" if value is None else value
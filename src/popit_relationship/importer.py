@@ -0,0 +1,181 @@
+import os
+import re
+from itertools import islice
+
+import click
+import networkx as nx
+import ujson
+from loguru import logger
+
+from popit_relationship.common import state_load, state_save
+from popit_relationship.export import ATTRIBUTE_NS, RDF_NS, XSD_NS
+from popit_relationship.store import graph_save
+from popit_relationship.sync import tree_insert, watermark_reset
+
+TRIPLE = re.compile(
+    r"^\s*(<[^>]*>|_:\S+)\s+<([^>]*)>\s+"
+    r'(<[^>]*>|_:\S+|"((?:[^"\\]|\\.)*)"(?:\^\^<([^>]*)>|@[a-zA-Z0-9-]+)?)\s*\.\s*$'
+)
+UCHAR = re.compile(r"\\u([0-9A-Fa-f]{4})|\\U([0-9A-Fa-f]{8})")
+ECHAR = re.compile(r'\\([tbnrf"\'\\])|\\u([0-9A-Fa-f]{4})|\\U([0-9A-Fa-f]{8})')
+ECHAR_LIST = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+
+
+@click.group("import")
+def importer():
+    pass
+
+
+@importer.command("jsonl")
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+def jsonl(source):
+    graph_import(jsonl_read(source))
+
+
+@importer.command("ntriples")
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+def ntriples(source):
+    graph_import(ntriples_read(source))
+
+
+def graph_import(tree_list):
+    graph = nx.MultiDiGraph()
+
+    for nodes, relationships in tree_list:
+        tree_insert(graph, nodes, relationships)
+
+    logger.info(
+        "Imported {} nodes and {} edges",
+        graph.number_of_nodes(),
+        graph.number_of_edges(),
+    )
+    graph_save(graph)
+
+    state = state_load()
+    watermark_reset(state)
+    state_save(state)
+
+
+def line_chunked(source):
+    # the input is read a chunk at a time, however large it is
+    size = int(os.environ.get("IMPORT_CHUNK_SIZE", 1000))
+
+    while True:
+        chunk = list(islice(source, size))
+
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def jsonl_read(source):
+    for chunk in line_chunked(source):
+        nodes, relationships = {}, []
+
+        for line in chunk:
+            if not line.strip():
+                continue
+
+            record = ujson.loads(line)
+
+            if "node" in record:
+                nodes[record["node"]] = record["attributes"]
+            else:
+                relationships.append(record)
+
+        yield nodes, relationships
+
+
+def ntriples_read(source):
+    # reifications carry the attributes of their edge, which is added with them
+    statement_list = {}
+
+    for chunk in line_chunked(source):
+        nodes, relationships = {}, []
+
+        for line in chunk:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+
+            match = TRIPLE.match(line)
+
+            if not match:
+                raise click.ClickException(f"Not a valid N-Triples line: {line}")
+
+            subject, predicate, object_, value, datatype = match.groups()
+            predicate = iri_unescape(predicate)
+
+            if subject.startswith("_:"):
+                statement = statement_list.setdefault(subject, {"attributes": {}})
+
+                if predicate.startswith(ATTRIBUTE_NS) and value is not None:
+                    statement["attributes"][predicate[len(ATTRIBUTE_NS) :]] = (
+                        literal_parse(value, datatype)
+                    )
+                elif predicate in (
+                    f"{RDF_NS}subject",
+                    f"{RDF_NS}predicate",
+                    f"{RDF_NS}object",
+                ):
+                    statement[predicate[len(RDF_NS) :]] = iri_unescape(object_[1:-1])
+            elif value is not None:
+                name = (
+                    predicate[len(ATTRIBUTE_NS) :]
+                    if predicate.startswith(ATTRIBUTE_NS)
+                    else predicate
+                )
+                nodes.setdefault(iri_unescape(subject[1:-1]), {})[name] = literal_parse(
+                    value, datatype
+                )
+            else:
+                relationships.append(
+                    {
+                        "subject": iri_unescape(subject[1:-1]),
+                        "predicate": {"key": predicate, "attributes": {}},
+                        "object": iri_unescape(object_[1:-1]),
+                    }
+                )
+
+        yield nodes, relationships
+
+    yield {}, [
+        {
+            "subject": statement["subject"],
+            "predicate": {
+                "key": statement["predicate"],
+                "attributes": statement["attributes"],
+            },
+            "object": statement["object"],
+        }
+        for statement in statement_list.values()
+        if {"subject", "predicate", "object"} <= set(statement)
+    ]
+
+
+def iri_unescape(value):
+    return UCHAR.sub(
+        lambda match: chr(int(match.group(1) or match.group(2), 16)), value
+    )
+
+
+def literal_parse(value, datatype):
+    value = ECHAR.sub(
+        lambda match: (
+            ECHAR_LIST.get(match.group(1), match.group(1))
+            if match.group(1)
+            else chr(int(match.group(2) or match.group(3), 16))
+        ),
+        value,
+    )
+
+    if datatype == f"{XSD_NS}boolean":
+        return value == "true"
+    elif datatype == f"{XSD_NS}integer":
+        return int(value)
+    elif datatype == f"{XSD_NS}double":
+        return float(value)
+    elif datatype == f"{RDF_NS}JSON":
+        return ujson.loads(value)
+
+    return value
@@ -0,0 +1,88 @@
+import os
+import random
+
+import networkx as nx
+import ujson
+
+from popit_relationship.common import file_replace
+
+LAYOUT_CACHE_PATH_DEFAULT = "./primport-layout.json"
+LAYOUT_LIST = ("spring", "circular", "shell", "random")
+
+
+def layout_build(graph, algorithm="spring", iterations=None):
+    if algorithm == "circular":
+        return nx.circular_layout(graph)
+    elif algorithm == "shell":
+        return nx.shell_layout(graph)
+    elif algorithm == "random":
+        return nx.random_layout(graph, seed=0)
+
+    return layout_build_spring(graph, iterations)
+
+
+def layout_build_spring(graph, iterations=None):
+    # nodes drawn before start where they were left, so that a repeat or an
+    # overlapping visualization only needs a few iterations to settle
+    cache = layout_cache_load()
+    position = {node: cache[node] for node in graph if node in cache}
+
+    for node in graph:
+        if node not in position:
+            position[node] = position_guess(graph, node, position)
+
+    if iterations is None:
+        iterations = (
+            int(os.environ.get("LAYOUT_ITERATIONS_REFINE", 15))
+            if any(node in cache for node in graph)
+            else int(os.environ.get("LAYOUT_ITERATIONS", 50))
+        )
+
+    # not rescaled, so that every visualization shares the coordinates in the cache
+    result = {
+        node: [float(x), float(y)]
+        for node, (x, y) in nx.spring_layout(
+            graph, pos=position, iterations=iterations, scale=None, seed=0
+        ).items()
+    }
+
+    cache.update(result)
+    layout_cache_save(cache)
+
+    return result
+
+
+def position_guess(graph, node, position):
+    # next to the neighbours already placed, or anywhere when there are none
+    neighbour_list = [
+        position[neighbour]
+        for neighbour in nx.all_neighbors(graph, node)
+        if neighbour in position
+    ]
+    generator = random.Random(node)
+
+    if not neighbour_list:
+        return [generator.random(), generator.random()]
+
+    return [
+        sum(point[axis] for point in neighbour_list) / len(neighbour_list)
+        + generator.uniform(-0.05, 0.05)
+        for axis in (0, 1)
+    ]
+
+
+def layout_cache_load():
+    try:
+        with open(
+            os.environ.get("LAYOUT_CACHE_PATH", LAYOUT_CACHE_PATH_DEFAULT)
+        ) as cache_file:
+            return ujson.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def layout_cache_save(cache):
+    path = os.environ.get("LAYOUT_CACHE_PATH", LAYOUT_CACHE_PATH_DEFAULT)
+
+    with file_replace(path) as path_tmp, open(path_tmp, "w") as cache_file:
+        ujson.dump(cache, cache_file)
@@ -0,0 +1,100 @@
+from popit_relationship.blob import blob_resolve
+from popit_relationship.common import node_get_type
+from popit_relationship.sync import CLASS_LIST
+
+
+def neighbourhood_build(
+    graph, node_list, depth_max, node_limit=None, predicate_list=None
+):
+    return neighbourhood_search(
+        [node for node in node_list if node in graph],
+        lambda node: graph_neighbours(graph, node, predicate_list),
+        depth_max,
+        node_limit,
+        CLASS_LIST,
+    )
+
+
+def neighbourhood_build_compact(
+    compact, node_list, depth_max, node_limit=None, predicate_list=None
+):
+    result = neighbourhood_search(
+        [compact.node_code(node) for node in node_list if node in compact.node_index],
+        lambda node: compact.neighbours(node, predicate_list).tolist(),
+        depth_max,
+        node_limit,
+        set(
+            compact.node_code(node) for node in CLASS_LIST if node in compact.node_index
+        ),
+    )
+
+    return {compact.node_list[node]: depth for node, depth in result.items()}
+
+
+def neighbourhood_search(node_list, neighbours, depth_max, node_limit, node_skip):
+    # breadth first, every node is expanded once, and only from the new frontier
+    result = {node: 0 for node in node_list if node not in node_skip}
+    frontier = sorted(result)
+
+    for depth in range(1, depth_max + 1):
+        frontier_next = []
+
+        for node in frontier:
+            for neighbour in sorted(neighbours(node)):
+                if neighbour in result or neighbour in node_skip:
+                    continue
+
+                if node_limit is not None and len(result) >= node_limit:
+                    return result
+
+                result[neighbour] = depth
+                frontier_next.append(neighbour)
+
+        if not frontier_next:
+            break
+
+        frontier = frontier_next
+
+    return result
+
+
+def graph_neighbours(graph, node, predicate_list=None):
+    if predicate_list is None:
+        return set(graph.successors(node)).union(graph.predecessors(node))
+
+    return set(
+        dest
+        for _source, dest, key, data in graph.out_edges(node, keys=True, data=True)
+        if edge_match(key, data, predicate_list)
+    ).union(
+        source
+        for source, _dest, key, data in graph.in_edges(node, keys=True, data=True)
+        if edge_match(key, data, predicate_list)
+    )
+
+
+def edge_match(key, data, predicate_list):
+    # relationships keep their precise predicate in the uri attribute
+    return key in predicate_list or data.get("uri", None) in predicate_list
+
+
+def neighbourhood_export(graph, neighbourhood, predicate_list=None):
+    return {
+        "nodes": [
+            {
+                "id": node,
+                "depth": depth,
+                "type": node_get_type(graph, node) or None,
+                "attributes": blob_resolve(graph.nodes[node]),
+            }
+            for node, depth in neighbourhood.items()
+        ],
+        "edges": [
+            {"source": source, "dest": dest, "key": key, "attributes": data}
+            for source, dest, key, data in graph.edges(
+                list(neighbourhood), keys=True, data=True
+            )
+            if dest in neighbourhood
+            and (predicate_list is None or edge_match(key, data, predicate_list))
+        ],
+    }
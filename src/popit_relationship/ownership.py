@@ -0,0 +1,134 @@
+import hashlib
+import os
+
+import ujson
+
+from popit_relationship.common import file_replace, node_get_name
+from popit_relationship.store import graph_init_predicate, store_version
+from popit_relationship.sync import TYPE_OWNERSHIP
+
+OWNERSHIP_CACHE_PATH_DEFAULT = "./primport-ownership.json"
+OWNERSHIP_DEPTH_DEFAULT = 10
+
+
+def ownership_chain(node, depth_max=OWNERSHIP_DEPTH_DEFAULT):
+    cache, version = ownership_cache_load(), store_version()
+    key = f"{node}\t{depth_max}"
+
+    if cache["version"] == version and key in cache["closure"]:
+        return cache["closure"][key]["chain_list"]
+
+    graph = graph_init_predicate(TYPE_OWNERSHIP)
+
+    if cache["version"] != version:
+        ownership_cache_invalidate(cache, graph)
+        cache["version"] = version
+
+    if key not in cache["closure"]:
+        chain_list, visited = chain_search(graph, node, depth_max)
+        cache["closure"][key] = {"chain_list": chain_list, "visited": sorted(visited)}
+
+    ownership_cache_save(cache)
+
+    return cache["closure"][key]["chain_list"]
+
+
+def ownership_chain_export(graph, node, chain_list):
+    # graph only needs the nodes on the chains, to name them
+    return {
+        "id": node,
+        "name": node_get_name(graph, node),
+        "chains": [
+            {
+                "end": chain["end"],
+                "path": [
+                    dict(step, name=node_get_name(graph, step["id"]))
+                    for step in chain["path"]
+                ],
+            }
+            for chain in chain_list
+        ],
+    }
+
+
+def chain_search(graph, node, depth_max):
+    # every path from node up through its owners, ending at an owner that is not
+    # owned itself, at an owner already on the path, or at depth_max
+    chain_list, visited, stack = [], {node}, [(node, [])]
+
+    while stack:
+        current, path = stack.pop()
+        owner_list = sorted(graph.predecessors(current)) if current in graph else []
+
+        if not owner_list:
+            if path:
+                chain_list.append({"path": path, "end": "root"})
+
+            continue
+
+        if len(path) >= depth_max:
+            chain_list.append({"path": path, "end": "depth"})
+            continue
+
+        for owner in reversed(owner_list):
+            step = dict(graph.get_edge_data(owner, current, TYPE_OWNERSHIP), id=owner)
+            visited.add(owner)
+
+            if owner == node or any(previous["id"] == owner for previous in path):
+                chain_list.append({"path": path + [step], "end": "cycle"})
+            else:
+                stack.append((owner, path + [step]))
+
+    # in a stable order, whatever order the search went in
+    return (
+        sorted(chain_list, key=lambda chain: [step["id"] for step in chain["path"]]),
+        visited,
+    )
+
+
+def ownership_cache_invalidate(cache, graph):
+    # a closure only depends on who owns the nodes it went through, so it is only
+    # dropped when the ownership of one of them changed
+    edge_hash = {
+        node: hashlib.blake2b(
+            ujson.dumps(
+                sorted(
+                    [source, data]
+                    for source, _dest, data in graph.in_edges(node, data=True)
+                ),
+                sort_keys=True,
+            ).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        for node in graph
+        if graph.in_degree(node)
+    }
+    changed = set(
+        node
+        for node in set(edge_hash) | set(cache["edge_hash"])
+        if edge_hash.get(node) != cache["edge_hash"].get(node)
+    )
+
+    cache["closure"] = {
+        key: closure
+        for key, closure in cache["closure"].items()
+        if changed.isdisjoint(closure["visited"])
+    }
+    cache["edge_hash"] = edge_hash
+
+
+def ownership_cache_load():
+    try:
+        with open(
+            os.environ.get("OWNERSHIP_CACHE_PATH", OWNERSHIP_CACHE_PATH_DEFAULT)
+        ) as cache_file:
+            return ujson.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return {"version": None, "edge_hash": {}, "closure": {}}
+
+
+def ownership_cache_save(cache):
+    path = os.environ.get("OWNERSHIP_CACHE_PATH", OWNERSHIP_CACHE_PATH_DEFAULT)
+
+    with file_replace(path) as path_tmp, open(path_tmp, "w") as cache_file:
+        ujson.dump(cache, cache_file)
@@ -1,17 +1,36 @@
 import asyncio
+import os
 from collections import defaultdict
-from functools import reduce
 
 import click
 import matplotlib.pyplot as plt
 import networkx as nx
+import ujson
 from dotenv import load_dotenv
-from toolz.dicttoolz import merge
 
 import popit_relationship.db as db
-from popit_relationship.common import graph_init, graph_save
+from popit_relationship.analyze import graph_analyze
+from popit_relationship.blob import blob_reset
+from popit_relationship.client import response_cache_clear
+from popit_relationship.common import node_get_type, state_load, state_save
 from popit_relationship.db import arrow_get_type
-from popit_relationship.sync import node_is_class, sync
+from popit_relationship.export import export
+from popit_relationship.importer import importer
+from popit_relationship.layout import LAYOUT_LIST, layout_build
+from popit_relationship.neighbourhood import neighbourhood_build, neighbourhood_export
+from popit_relationship.ownership import (
+    OWNERSHIP_DEPTH_DEFAULT,
+    ownership_chain,
+    ownership_chain_export,
+)
+from popit_relationship.serve import serve
+from popit_relationship.store import (
+    graph_init,
+    graph_init_neighbourhood,
+    graph_init_node,
+    graph_save,
+)
+from popit_relationship.sync import node_is_class, sync, watermark_reset
 
 
 @click.group()
@@ -27,29 +46,42 @@ def reset_db():
     with db.driver_init() as driver, driver.session() as session:
         session.write_transaction(lambda tx: tx.run("MATCH (n) DETACH DELETE n"))
 
+    db.snapshot_reset()
+
 
 @reset.command("cache")
 @click.confirmation_option(
     prompt="The specified cache will be deleted, is the data backed up?"
 )
 def reset_cache():
-    graph = graph_init()
-    graph.clear()
-    graph_save(graph)
+    graph_save(nx.MultiDiGraph())
+    blob_reset()
+    response_cache_clear()
+
+    state = state_load()
+    watermark_reset(state)
+    state_save(state)
 
 
 @click.command("visualize")
 @click.argument("node_list", nargs=-1)
 @click.option("--depth", type=click.INT, default=3)
-def visualize(node_list, depth):
-    graph = graph_init()
+@click.option("--layout", "algorithm", type=click.Choice(LAYOUT_LIST), default="spring")
+@click.option("--iterations", type=click.INT, default=None)
+@click.option("--output", type=click.Path(dir_okay=False), default=None)
+def visualize(node_list, depth, algorithm, iterations, output):
+    if output:
+        # renders to a file without a display, e.g. on a server
+        plt.switch_backend("Agg")
 
-    neighbourhood = node_populate_neighbours(graph, set(node_list), depth)
+    graph = graph_init_neighbourhood(node_list, depth, node_is_class)
 
-    subgraph = nx.subgraph(graph, neighbourhood)
-    layout = nx.spring_layout(subgraph)
+    subgraph = nx.subgraph(graph, neighbourhood_build(graph, node_list, depth))
+    layout = layout_build(subgraph, algorithm, iterations)
+
+    plt.figure(figsize=[max(8, len(subgraph) ** 0.5 * 2)] * 2)
     nx.draw_networkx_nodes(
-        subgraph, layout, with_labels=True,
+        subgraph, layout, node_color=node_color_list(graph, subgraph),
     )
     nx.draw_networkx_labels(
         subgraph,
@@ -65,56 +97,92 @@ def visualize(node_list, depth):
     nx.draw_networkx_edge_labels(
         subgraph,
         layout,
-        edge_labels=reduce(
-            lambda current, incoming: merge(
-                current,
-                {
-                    (incoming[0], incoming[1]): arrow_get_type(
-                        subgraph.get_edge_data(*incoming).get("uri", incoming[-1])
-                    )
-                },
-            ),
-            subgraph.edges,
-            {},
-        ),
+        edge_labels={
+            (source, dest): arrow_get_type(data.get("uri", key))
+            for source, dest, key, data in subgraph.edges(keys=True, data=True)
+        },
     )
-    plt.show()
 
+    if output:
+        plt.savefig(output, bbox_inches="tight")
+    else:
+        plt.show()
 
-def node_populate_neighbours(graph, node_list, depth_max, depth_current=0):
-    to_return = set()
 
-    if depth_max == depth_current:
-        to_return = node_list
-    else:
-        result = reduce(
-            lambda current, incoming: current.union(
-                set()
-                if node_is_class(incoming)
-                else set(
-                    node
-                    for node in nx.all_neighbors(graph, incoming)
-                    if not node_is_class(node)
-                ).union(set([incoming]))
+def node_color_list(graph, node_list):
+    type_list = sorted(set(str(node_get_type(graph, node)) for node in node_list))
+
+    return [
+        plt.cm.tab10(type_list.index(str(node_get_type(graph, node))) % 10)
+        for node in node_list
+    ]
+
+
+@click.command("neighbourhood")
+@click.argument("node_list", nargs=-1)
+@click.option("--depth", type=click.INT, default=3)
+@click.option("--limit", type=click.INT, default=None)
+@click.option("--predicate", "predicate_list", multiple=True)
+def neighbourhood(node_list, depth, limit, predicate_list):
+    predicate_list = set(predicate_list) or None
+    graph = graph_init_neighbourhood(node_list, depth, node_is_class)
+
+    click.echo(
+        ujson.dumps(
+            neighbourhood_export(
+                graph,
+                neighbourhood_build(graph, node_list, depth, limit, predicate_list),
+                predicate_list,
             ),
-            node_list,
-            set(),
+            indent=2,
+            ensure_ascii=False,
+            escape_forward_slashes=False,
+        )
+    )
+
+
+@click.command("ownership-chain")
+@click.argument("node")
+@click.option("--depth", type=click.INT, default=OWNERSHIP_DEPTH_DEFAULT)
+def ownership_chain_show(node, depth):
+    chain_list = ownership_chain(node, depth)
+    graph = graph_init_node(
+        set([node]).union(
+            step["id"] for chain in chain_list for step in chain["path"]
+        )
+    )
+
+    click.echo(
+        ujson.dumps(
+            ownership_chain_export(graph, node, chain_list),
+            indent=2,
+            ensure_ascii=False,
+            escape_forward_slashes=False,
         )
+    )
 
-        if len(result) == len(node_list):
-            to_return = node_list
-        else:
-            to_return = node_populate_neighbours(
-                graph, result, depth_max, depth_current + 1
-            )
 
-    return to_return
+@click.command("analyze")
+@click.option(
+    "--workers",
+    type=click.INT,
+    default=lambda: int(os.environ.get("ANALYZE_WORKERS", os.cpu_count() or 1)),
+)
+@click.option("--force", is_flag=True)
+def analyze(workers, force):
+    graph_analyze(workers, force)
 
 
 @click.command("save")
-def save():
-    with db.driver_init() as driver, driver.session() as session:
-        session.write_transaction(db.graph_save, graph_init())
+@click.option("--full", is_flag=True)
+@click.option(
+    "--workers",
+    type=click.INT,
+    default=lambda: int(os.environ.get("NEO4J_WORKERS", 1)),
+)
+def save(full, workers):
+    with db.driver_init() as driver:
+        db.graph_save(driver, graph_init(), full, workers)
 
 
 @click.group()
@@ -122,9 +190,15 @@ def app():
     pass
 
 
+app.add_command(analyze)
+app.add_command(export)
+app.add_command(importer)
 app.add_command(reset)
 app.add_command(visualize)
+app.add_command(neighbourhood)
+app.add_command(ownership_chain_show)
 app.add_command(save)
+app.add_command(serve)
 app.add_command(sync)
 
 
@@ -0,0 +1,231 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+import click
+import ujson
+from aiohttp import web
+from loguru import logger
+
+from popit_relationship.blob import blob_resolve
+from popit_relationship.common import node_get_type
+from popit_relationship.compact import (
+    compact_build,
+    compact_predicate_graph,
+    compact_subgraph,
+)
+from popit_relationship.neighbourhood import (
+    neighbourhood_build_compact,
+    neighbourhood_export,
+)
+from popit_relationship.ownership import (
+    OWNERSHIP_DEPTH_DEFAULT,
+    chain_search,
+    ownership_chain_export,
+)
+from popit_relationship.store import graph_init, shard_version_list
+from popit_relationship.sync import TYPE_OWNERSHIP
+
+
+@click.command("serve")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=click.INT, default=8080)
+@click.option(
+    "--reload-interval",
+    type=click.FLOAT,
+    default=lambda: float(os.environ.get("SERVE_RELOAD_INTERVAL", 60)),
+)
+@click.option(
+    "--cache-size",
+    type=click.INT,
+    default=lambda: int(os.environ.get("SERVE_CACHE_SIZE", 1024)),
+)
+def serve(host, port, reload_interval, cache_size):
+    web.run_app(
+        GraphServer(reload_interval, cache_size).application(), host=host, port=port
+    )
+
+
+class Snapshot:
+    # everything a query reads, swapped as a whole when the cache is reloaded, so
+    # that a query never mixes two versions. Only the arrays are kept, the graph they
+    # are built from is dropped, and what a query returns is read back from them
+    def __init__(self, compact, version, cache_size):
+        self.compact = compact
+        self.ownership = compact_predicate_graph(compact, [TYPE_OWNERSHIP])
+        self.version = version
+        self.cache_size = cache_size
+        self.result_list = OrderedDict()
+
+    def query(self, key, compute):
+        if key in self.result_list:
+            self.result_list.move_to_end(key)
+            return self.result_list[key]
+
+        result = self.result_list[key] = compute()
+
+        if len(self.result_list) > self.cache_size:
+            self.result_list.popitem(last=False)
+
+        return result
+
+
+class GraphServer:
+    def __init__(self, reload_interval=60, cache_size=1024):
+        self.reload_interval = reload_interval
+        self.cache_size = cache_size
+        self.snapshot = None
+
+    def application(self):
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/node", self.node_get),
+                web.get("/neighbourhood", self.neighbourhood_get),
+                web.get("/ownership-chain", self.ownership_chain_get),
+            ]
+        )
+        app.cleanup_ctx.append(self.reload_context)
+
+        return app
+
+    async def reload_context(self, _app):
+        await self.reload()
+
+        task = asyncio.ensure_future(self.reload_loop())
+
+        yield
+
+        task.cancel()
+
+    async def reload_loop(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+
+            try:
+                await self.reload()
+            except Exception as error:
+                logger.exception(error)
+
+    async def reload(self):
+        # the cache is read in another thread, queries keep being answered from the
+        # previous snapshot meanwhile
+        loop = asyncio.get_event_loop()
+        version = await loop.run_in_executor(None, shard_version_list)
+
+        if self.snapshot is not None and self.snapshot.version == version:
+            return
+
+        self.snapshot = await loop.run_in_executor(
+            None,
+            lambda: Snapshot(compact_build(graph_init()), version, self.cache_size),
+        )
+
+        logger.info(
+            "Serving {} nodes and {} edges",
+            self.snapshot.compact.number_of_nodes(),
+            self.snapshot.compact.number_of_edges(),
+        )
+
+    async def node_get(self, request):
+        snapshot, node = self.snapshot, query_id(request)
+
+        if node not in snapshot.compact.node_index:
+            raise web.HTTPNotFound(text=f"{node} is not in the cache")
+
+        return json_response(
+            snapshot.query(
+                ("node", node),
+                lambda: node_export(compact_subgraph(snapshot.compact, [node]), node),
+            )
+        )
+
+    async def neighbourhood_get(self, request):
+        snapshot = self.snapshot
+        node_list = tuple(sorted(request.query.getall("node", [])))
+        depth = query_int(request, "depth", 3)
+        limit = query_int(request, "limit", None)
+        predicate_list = tuple(sorted(request.query.getall("predicate", []))) or None
+
+        def compute():
+            neighbourhood = neighbourhood_build_compact(
+                snapshot.compact, node_list, depth, limit, predicate_list
+            )
+
+            return neighbourhood_export(
+                compact_subgraph(snapshot.compact, neighbourhood),
+                neighbourhood,
+                predicate_list,
+            )
+
+        return json_response(
+            snapshot.query(
+                ("neighbourhood", node_list, depth, limit, predicate_list), compute
+            )
+        )
+
+    async def ownership_chain_get(self, request):
+        snapshot, node = self.snapshot, query_id(request)
+        depth = query_int(request, "depth", OWNERSHIP_DEPTH_DEFAULT)
+
+        def compute():
+            chain_list = chain_search(snapshot.ownership, node, depth)[0]
+
+            return ownership_chain_export(
+                compact_subgraph(
+                    snapshot.compact,
+                    set([node]).union(
+                        step["id"] for chain in chain_list for step in chain["path"]
+                    ),
+                ),
+                node,
+                chain_list,
+            )
+
+        return json_response(snapshot.query(("ownership-chain", node, depth), compute))
+
+
+def node_export(graph, node):
+    return {
+        "id": node,
+        "type": node_get_type(graph, node) or None,
+        "attributes": blob_resolve(graph.nodes[node]),
+        # in the same order however the shards were merged
+        "out": [
+            {"dest": dest, "key": key, "attributes": data}
+            for _source, dest, key, data in sorted(
+                graph.out_edges(node, keys=True, data=True),
+                key=lambda edge: edge[1:3],
+            )
+        ],
+        "in": [
+            {"source": source, "key": key, "attributes": data}
+            for source, _dest, key, data in sorted(
+                graph.in_edges(node, keys=True, data=True),
+                key=lambda edge: (edge[0], edge[2]),
+            )
+        ],
+    }
+
+
+def query_id(request):
+    if "id" not in request.query:
+        raise web.HTTPBadRequest(text="id is required")
+
+    return request.query["id"]
+
+
+def query_int(request, name, default):
+    try:
+        return int(request.query[name]) if name in request.query else default
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+
+
+def json_response(result):
+    return web.json_response(
+        result,
+        dumps=lambda value: ujson.dumps(
+            value, ensure_ascii=False, escape_forward_slashes=False
+        ),
+    )
@@ -0,0 +1,58 @@
+import os
+import shutil
+from urllib.parse import quote
+
+import ujson
+
+from popit_relationship.common import file_replace
+
+SPOOL_PATH_DEFAULT = "./primport-spool"
+
+
+def spool_path(portal_type):
+    return os.path.join(
+        os.environ.get("SPOOL_PATH", SPOOL_PATH_DEFAULT), quote(portal_type, safe="")
+    )
+
+
+def spool_open(portal_type, since=None, resume=False):
+    path = spool_path(portal_type)
+
+    # pages spooled for a different query cannot be reused
+    if not (resume and spool_query_get(path) == (since or "")):
+        spool_clear(portal_type)
+
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, "query"), "w") as query_file:
+        query_file.write(since or "")
+
+    return path
+
+
+def spool_query_get(path):
+    try:
+        with open(os.path.join(path, "query")) as query_file:
+            return query_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def spool_load(path, b_start):
+    try:
+        with open(os.path.join(path, f"{b_start}.json")) as page_file:
+            return ujson.load(page_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def spool_save(path, b_start, page):
+    # an interrupted write never looks like a complete page
+    with file_replace(os.path.join(path, f"{b_start}.json")) as path_tmp, open(
+        path_tmp, "w"
+    ) as page_file:
+        ujson.dump(page, page_file)
+
+
+def spool_clear(portal_type):
+    shutil.rmtree(spool_path(portal_type), ignore_errors=True)
@@ -0,0 +1,463 @@
+import os
+import pickle
+import sqlite3
+from contextlib import closing, contextmanager
+from itertools import islice
+from urllib.parse import quote
+
+import networkx as nx
+import ujson
+from loguru import logger
+
+from popit_relationship.common import (
+    KEY_OWNERSHIP,
+    KEY_RELATIONSHIP,
+    KEY_TYPE,
+    file_replace,
+    node_type_index,
+)
+
+CACHE_PATH_DEFAULT = "./primport-cache.gpickle"
+CACHE_SHARD_PATH_DEFAULT = "./primport-cache-shards"
+CACHE_STORE_PATH_DEFAULT = "./primport-cache.sqlite3"
+SHARD_UNTYPED = "untyped"
+# derived from the other shards, and merged after them so that it always wins
+SHARD_ANALYSIS = "analysis"
+# edges of these predicates are synced on their own, into a shard named after them
+SHARD_PREDICATE_LIST = (KEY_OWNERSHIP, KEY_RELATIONSHIP)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS node (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    attributes TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS node_type ON node (type);
+CREATE TABLE IF NOT EXISTS edge (
+    source TEXT NOT NULL,
+    dest TEXT NOT NULL,
+    key TEXT NOT NULL,
+    attributes TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (source, dest, key)
+);
+CREATE INDEX IF NOT EXISTS edge_dest ON edge (dest);
+CREATE INDEX IF NOT EXISTS edge_key ON edge (key);
+CREATE TABLE IF NOT EXISTS shard (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+# sqlite limits the number of parameters in a single statement
+PARAMETER_MAX = 500
+
+
+@contextmanager
+def store_open(path=None):
+    # the store is a merged view of the shards, rebuilt whenever one of them changes
+    path = path or os.environ.get("CACHE_STORE_PATH", CACHE_STORE_PATH_DEFAULT)
+    connection = sqlite3.connect(
+        path, timeout=float(os.environ.get("CACHE_TIMEOUT", 60))
+    )
+
+    try:
+        # readers are not blocked while the view is rebuilt
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+        if not os.path.isdir(shard_directory()):
+            shard_migrate(connection)
+
+        view_refresh(connection)
+
+        yield connection
+    finally:
+        connection.close()
+
+
+def view_refresh(connection):
+    if shard_version_list() == view_version_list(connection):
+        return
+
+    with connection:
+        connection.execute("BEGIN IMMEDIATE")
+
+        # another process may have rebuilt it while this one waited for the lock
+        version_list = shard_version_list()
+
+        if version_list == view_version_list(connection):
+            return
+
+        connection.execute("DELETE FROM edge")
+        connection.execute("DELETE FROM node")
+        connection.execute("DELETE FROM shard")
+
+        for name in shard_name_sorted(version_list):
+            with closing(sqlite3.connect(shard_path(name))) as shard:
+                view_merge(connection, shard)
+
+        connection.executemany(
+            "INSERT INTO shard (name, version) VALUES (?, ?)", version_list.items()
+        )
+
+
+def view_merge(connection, shard):
+    # a node can be the bare end of an edge in one shard and described in another
+    connection.executemany(
+        """
+        INSERT INTO node (id, type, attributes) VALUES (?, ?, ?)
+        ON CONFLICT (id) DO UPDATE
+        SET type = coalesce(node.type, excluded.type),
+            attributes = json_patch(node.attributes, excluded.attributes)
+        """,
+        shard.execute("SELECT id, type, attributes FROM node ORDER BY rowid"),
+    )
+    connection.executemany(
+        """
+        INSERT INTO edge (source, dest, key, attributes) VALUES (?, ?, ?, ?)
+        ON CONFLICT (source, dest, key) DO UPDATE
+        SET attributes = json_patch(edge.attributes, excluded.attributes)
+        """,
+        shard.execute("SELECT source, dest, key, attributes FROM edge ORDER BY rowid"),
+    )
+
+
+def view_version_list(connection):
+    return dict(connection.execute("SELECT name, version FROM shard"))
+
+
+def shard_migrate(connection):
+    # the caches written by older versions are split into shards, CACHE_PATH still
+    # names the gpickle they wrote, so that their configuration keeps working
+    graph, path = None, os.environ.get("CACHE_PATH", CACHE_PATH_DEFAULT)
+
+    if connection.execute("SELECT 1 FROM node LIMIT 1").fetchone():
+        graph = graph_read(
+            connection.execute("SELECT id, type, attributes FROM node ORDER BY rowid"),
+            connection.execute(
+                "SELECT source, dest, key, attributes FROM edge ORDER BY rowid"
+            ),
+        )
+    elif os.path.exists(path):
+        with open(path, "rb") as gpickle_file:
+            graph = pickle.load(gpickle_file)
+
+        logger.info("Migrating the cache from {}, it can be removed afterwards", path)
+
+    os.makedirs(shard_directory(), exist_ok=True)
+
+    if graph is not None:
+        graph_save(graph)
+
+
+def shard_directory_init():
+    # a cache written by an older version is split into shards before a sync writes
+    # the first one, or it would never be migrated
+    if not os.path.isdir(shard_directory()):
+        with store_open():
+            pass
+
+
+def shard_directory():
+    return os.environ.get("CACHE_SHARD_PATH", CACHE_SHARD_PATH_DEFAULT)
+
+
+def shard_path(name):
+    return os.path.join(shard_directory(), f"{name}.sqlite3")
+
+
+def shard_name(node_type):
+    return quote(node_type, safe="") if node_type else SHARD_UNTYPED
+
+
+def shard_name_sorted(name_list):
+    return sorted(name_list, key=lambda name: (name == SHARD_ANALYSIS, name))
+
+
+def shard_version_list():
+    try:
+        return {
+            entry.name[: -len(".sqlite3")]: shard_version(entry.stat())
+            for entry in os.scandir(shard_directory())
+            if entry.name.endswith(".sqlite3")
+        }
+    except FileNotFoundError:
+        return {}
+
+
+def shard_version(stat):
+    # a rename always brings a new inode, even when the mtime is too coarse to change
+    return f"{stat.st_ino}:{stat.st_mtime_ns}"
+
+
+def shard_load(node_type):
+    path = shard_path(shard_name(node_type))
+
+    if not os.path.exists(path):
+        return nx.MultiDiGraph()
+
+    with closing(sqlite3.connect(path)) as shard:
+        return graph_read(
+            shard.execute("SELECT id, type, attributes FROM node ORDER BY rowid"),
+            shard.execute(
+                "SELECT source, dest, key, attributes FROM edge ORDER BY rowid"
+            ),
+        )
+
+
+def shard_exists(node_type):
+    return os.path.exists(shard_path(shard_name(node_type)))
+
+
+def shard_save(node_type, graph):
+    # readers and other syncs only ever see a complete shard
+    os.makedirs(shard_directory(), exist_ok=True)
+
+    with file_replace(shard_path(shard_name(node_type))) as path_tmp:
+        shard_write(path_tmp, graph)
+
+
+def shard_write(path, graph):
+    with closing(sqlite3.connect(path)) as shard, shard:
+        shard.executescript(SCHEMA)
+        graph_write(shard, graph)
+
+
+def shard_split(graph):
+    # split the same way the syncs write the shards, so that the next sync of a
+    # portal type replaces, and deletes, what was split into its shard
+    index, result = node_type_index(graph), {}
+
+    for node, data in graph.nodes(data=True):
+        # bare ends of edges are written along with the edges
+        if not data and node not in index and graph.degree(node):
+            continue
+
+        shard = result.setdefault(index.get(node), nx.MultiDiGraph())
+        shard.add_node(node, **data)
+
+        if node in index:
+            node_type_index(shard)[node] = index[node]
+
+    for source, dest, key, data in graph.edges(keys=True, data=True):
+        result.setdefault(
+            key if key in SHARD_PREDICATE_LIST else index.get(source),
+            nx.MultiDiGraph(),
+        ).add_edge(source, dest, key=key, **data)
+
+    return result
+
+
+def graph_init():
+    with store_open() as connection:
+        return graph_read(
+            connection.execute("SELECT id, type, attributes FROM node ORDER BY rowid"),
+            connection.execute(
+                "SELECT source, dest, key, attributes FROM edge ORDER BY rowid"
+            ),
+        )
+
+
+def graph_init_shard(name_skip=()):
+    # merged straight from the shards, e.g. without those derived from the others
+    shard_directory_init()
+
+    with closing(sqlite3.connect(":memory:")) as connection:
+        connection.executescript(SCHEMA)
+
+        for name in shard_name_sorted(shard_version_list()):
+            if name in name_skip:
+                continue
+
+            with closing(sqlite3.connect(shard_path(name))) as shard:
+                view_merge(connection, shard)
+
+        return graph_read(
+            connection.execute("SELECT id, type, attributes FROM node ORDER BY rowid"),
+            connection.execute(
+                "SELECT source, dest, key, attributes FROM edge ORDER BY rowid"
+            ),
+        )
+
+
+def graph_init_neighbourhood(node_list, depth, node_skip=lambda _node: False):
+    # only the nodes within depth of node_list (not expanding past node_skip) are
+    # loaded, along with the edges between them and their types
+    with store_open() as connection:
+        visited, frontier = set(node_list), set(node_list)
+
+        for _depth in range(depth):
+            frontier = (
+                set(
+                    node
+                    for source, dest, _key, _attributes in edge_select_incident(
+                        connection, [node for node in frontier if not node_skip(node)]
+                    )
+                    for node in (source, dest)
+                    if not node_skip(node)
+                )
+                - visited
+            )
+
+            if not frontier:
+                break
+
+            visited.update(frontier)
+
+        return graph_read(
+            statement_chunked(
+                connection,
+                "SELECT id, type, attributes FROM node WHERE id IN ({})",
+                visited,
+            ),
+            (
+                edge
+                for edge in statement_chunked(
+                    connection,
+                    "SELECT source, dest, key, attributes FROM edge WHERE source IN ({})",
+                    visited,
+                )
+                if edge[1] in visited or edge[2] == KEY_TYPE
+            ),
+        )
+
+
+def graph_init_predicate(predicate):
+    # just the edges of one predicate, e.g. to follow ownership without the rest
+    with store_open() as connection:
+        return graph_read(
+            (),
+            connection.execute(
+                """
+                SELECT source, dest, key, attributes FROM edge
+                WHERE key = ?
+                ORDER BY rowid
+                """,
+                (predicate,),
+            ),
+        )
+
+
+def graph_init_node(node_list):
+    with store_open() as connection:
+        return graph_read(
+            statement_chunked(
+                connection,
+                "SELECT id, type, attributes FROM node WHERE id IN ({})",
+                node_list,
+            ),
+            (),
+        )
+
+
+def store_version():
+    # changes whenever a shard does
+    with store_open() as connection:
+        return view_version_list(connection)
+
+
+def graph_save(graph):
+    # every shard is written before any is replaced, and shards written by a sync
+    # meanwhile are newer than the graph, so they are kept
+    version_list, path_list = shard_version_list(), {}
+
+    os.makedirs(shard_directory(), exist_ok=True)
+
+    try:
+        for node_type, shard in shard_split(graph).items():
+            name = shard_name(node_type)
+            path_list[name] = f"{shard_path(name)}.{os.getpid()}.tmp"
+
+            if os.path.exists(path_list[name]):
+                os.remove(path_list[name])
+
+            shard_write(path_list[name], shard)
+
+        version_list_current = shard_version_list()
+
+        for name in set(version_list) | set(path_list):
+            if version_list_current.get(name) != version_list.get(name):
+                logger.warning("The {} shard was written meanwhile, keeping it", name)
+            elif name in path_list:
+                os.replace(path_list[name], shard_path(name))
+            else:
+                os.remove(shard_path(name))
+    finally:
+        for path in path_list.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def graph_read(node_row_list, edge_row_list):
+    graph = nx.MultiDiGraph()
+    index = node_type_index(graph)
+
+    for node, node_type, attributes in node_row_list:
+        graph.add_node(node, **ujson.loads(attributes))
+
+        if node_type:
+            index[node] = node_type
+
+    for source, dest, key, attributes in edge_row_list:
+        graph.add_edge(source, dest, key=key, **ujson.loads(attributes))
+
+    return graph
+
+
+def graph_write(connection, graph):
+    index = node_type_index(graph)
+
+    # bare nodes are only the ends of edges, and must not wipe what is stored
+    connection.executemany(
+        "INSERT OR IGNORE INTO node (id) VALUES (?)",
+        ((node,) for node, data in graph.nodes(data=True) if not data),
+    )
+    connection.executemany(
+        """
+        INSERT INTO node (id, attributes) VALUES (?, ?)
+        ON CONFLICT (id) DO UPDATE
+        SET attributes = json_patch(node.attributes, excluded.attributes)
+        """,
+        ((node, ujson.dumps(data)) for node, data in graph.nodes(data=True) if data),
+    )
+    connection.executemany(
+        """
+        INSERT INTO edge (source, dest, key, attributes) VALUES (?, ?, ?, ?)
+        ON CONFLICT (source, dest, key) DO UPDATE
+        SET attributes = json_patch(edge.attributes, excluded.attributes)
+        """,
+        (
+            (source, dest, key, ujson.dumps(data))
+            for source, dest, key, data in graph.edges(keys=True, data=True)
+        ),
+    )
+    connection.executemany(
+        "UPDATE node SET type = ? WHERE id = ? AND type IS NULL",
+        ((node_type, node) for node, node_type in index.items()),
+    )
+
+
+def edge_select_incident(connection, node_list):
+    yield from statement_chunked(
+        connection,
+        "SELECT source, dest, key, attributes FROM edge WHERE source IN ({})",
+        node_list,
+    )
+    yield from statement_chunked(
+        connection,
+        "SELECT source, dest, key, attributes FROM edge WHERE dest IN ({})",
+        node_list,
+    )
+
+
+def statement_chunked(connection, statement, node_list):
+    for chunk in chunk_split(node_list):
+        yield from connection.execute(
+            statement.format(", ".join("?" * len(chunk))), chunk
+        )
+
+
+def chunk_split(node_list):
+    iterator = iter(node_list)
+
+    return iter(lambda: list(islice(iterator, PARAMETER_MAX)), [])
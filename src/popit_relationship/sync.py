@@ -1,15 +1,32 @@
+import asyncio
 import os
-import time
-from functools import reduce
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 from urllib.parse import parse_qs, urlsplit
 
-import aiohttp
 import click
-import ujson
+import networkx as nx
 from loguru import logger
 from toolz.dicttoolz import get_in, valfilter
 
-from popit_relationship.common import coro, graph_init, graph_prune, graph_save
+from popit_relationship.blob import blob_offload
+from popit_relationship.client import client_start
+from popit_relationship.common import (
+    KEY_TYPE,
+    coro,
+    node_prune,
+    node_set_type,
+    state_load,
+    state_save,
+)
+from popit_relationship.spool import spool_clear, spool_load, spool_open, spool_save
+from popit_relationship.store import (
+    shard_directory_init,
+    shard_exists,
+    shard_load,
+    shard_save,
+)
 
 TYPE_PERSON = "https://www.w3.org/ns/person#Person"
 TYPE_POST = "http://www.w3.org/ns/org#Post"
@@ -18,6 +35,11 @@ TYPE_MEMBERSHIP = "http://www.w3.org/ns/org#Membership"
 TYPE_RELATIONSHIP = "http://purl.org/vocab/relationship/Relationship"
 
 SINAR_NS_MOCK = "https://sinarproject.org/ns/ownership#"
+TYPE_OWNERSHIP = f"{SINAR_NS_MOCK}ownershipOrControlStatement"
+
+CLASS_LIST = frozenset(
+    (TYPE_PERSON, TYPE_RELATIONSHIP, TYPE_ORGANIZATION, TYPE_POST, TYPE_MEMBERSHIP)
+)
 
 
 @click.group()
@@ -25,26 +47,30 @@ def sync():
     pass
 
 
+def sync_options(f):
+    for option in (
+        click.option("--offline", is_flag=True),
+        click.option("--resume", is_flag=True),
+        click.option("--delta", is_flag=True),
+    ):
+        f = option(f)
+
+    return f
+
+
 @sync.command("all")
+@sync_options
 @coro
 @click.pass_context
-async def all_sync(_ctx):
-    await tree_import(TYPE_PERSON, "Person", person_build_node)
-    await tree_import(TYPE_RELATIONSHIP, "Relationship", relationship_build_node)
-    await tree_import(TYPE_ORGANIZATION, "Organization", organization_build_node)
-    await tree_import(TYPE_POST, "Post", post_build_node)
-    await tree_import(TYPE_MEMBERSHIP, "Membership", membership_build_node)
-    await tree_import(
-        f"{SINAR_NS_MOCK}ownershipOrControlStatement",
-        "Ownership Control Statement",
-        ownership_build_node,
-    )
+async def all_sync(_ctx, **options):
+    await tree_import_many(TREE_LIST, **options)
 
 
 @sync.command("membership")
+@sync_options
 @coro
-async def membership():
-    await tree_import(TYPE_MEMBERSHIP, "Membership", membership_build_node)
+async def membership(**options):
+    await tree_import(TYPE_MEMBERSHIP, "Membership", membership_build_node, **options)
 
 
 def membership_build_node(membership):
@@ -100,12 +126,11 @@ def membership_build_node(membership):
 
 
 @sync.command("ownership")
+@sync_options
 @coro
-async def ownership():
+async def ownership(**options):
     await tree_import(
-        f"{SINAR_NS_MOCK}ownershipOrControlStatement",
-        "Ownership Control Statement",
-        ownership_build_node,
+        TYPE_OWNERSHIP, "Ownership Control Statement", ownership_build_node, **options
     )
 
 
@@ -117,7 +142,7 @@ def ownership_build_node(ownership):
                 {
                     "subject": get_in(["interestedParty", "@id"], ownership, None),
                     "predicate": {
-                        "key": f"{SINAR_NS_MOCK}ownershipOrControlStatement",
+                        "key": TYPE_OWNERSHIP,
                         "attributes": predicate_attribute_filter_empty(
                             {
                                 "interest_level": get_in(
@@ -137,9 +162,10 @@ def ownership_build_node(ownership):
 
 
 @sync.command("post")
+@sync_options
 @coro
-async def post():
-    await tree_import(TYPE_POST, "Post", post_build_node)
+async def post(**options):
+    await tree_import(TYPE_POST, "Post", post_build_node, **options)
 
 
 def post_build_node(post):
@@ -171,9 +197,12 @@ def post_build_node(post):
 
 
 @sync.command("org")
+@sync_options
 @coro
-async def organization():
-    await tree_import(TYPE_ORGANIZATION, "Organization", organization_build_node)
+async def organization(**options):
+    await tree_import(
+        TYPE_ORGANIZATION, "Organization", organization_build_node, **options
+    )
 
 
 def organization_build_node(organization):
@@ -213,9 +242,12 @@ def organization_build_node(organization):
 
 
 @sync.command("rel")
+@sync_options
 @coro
-async def relationship():
-    await tree_import(TYPE_RELATIONSHIP, "Relationship", relationship_build_node)
+async def relationship(**options):
+    await tree_import(
+        TYPE_RELATIONSHIP, "Relationship", relationship_build_node, **options
+    )
 
 
 def relationship_build_node(relationship):
@@ -259,14 +291,57 @@ def relationship_get_attributes(relationship):
     return result
 
 
-def param_build(portal_type, b_start):
-    return {"portal_type": portal_type, "fullobjects": 1, "b_start": b_start}
+def param_build(portal_type, b_start, since=None):
+    return (
+        [("portal_type", portal_type)]
+        + projection_param_build(PROJECTION.get(portal_type, None))
+        + [("b_start", b_start)]
+        + (
+            [
+                ("modified.query", since),
+                ("modified.range", "min"),
+                ("sort_on", "modified"),
+            ]
+            if since
+            else []
+        )
+    )
+
+
+def projection_param_build(projection):
+    # metadata_fields only returns flat catalog metadata, so anything reading into a
+    # nested object still needs fullobjects
+    if projection and all(len(path) == 1 for path in projection):
+        return [("metadata_fields", path[0]) for path in projection]
+    else:
+        return [("fullobjects", 1)]
+
+
+def entity_project(entity, projection):
+    result = {}
+
+    for path in projection:
+        source, target = entity, result
+
+        for key in path[:-1]:
+            source = source.get(key, None)
+
+            if not isinstance(source, dict):
+                break
+
+            target = target.setdefault(key, {})
+        else:
+            if path[-1] in source:
+                target[path[-1]] = source[path[-1]]
+
+    return result
 
 
 @sync.command("person")
+@sync_options
 @coro
-async def person():
-    await tree_import(TYPE_PERSON, "Person", person_build_node)
+async def person(**options):
+    await tree_import(TYPE_PERSON, "Person", person_build_node, **options)
 
 
 def person_build_node(person):
@@ -298,37 +373,79 @@ def attribute_filter_empty(result):
     return valfilter(lambda x: x is not None, result)
 
 
-async def fetch(portal_type, session_api, b_start=0, _result=None):
-    async with session_api.get(
-        os.environ.get("ENDPOINT_API", "https://politikus.sinarproject.org/@search"),
-        params=param_build(portal_type, b_start),
-    ) as response:
-        click.echo(f"Fetching from {response.url}")
+async def fetch(portal_type, client, since=None, spool=None):
+    async def page_get(b_start):
+        page = spool_load(spool, b_start) if spool else None
+
+        if page is None:
+            page = await page_fetch(portal_type, client, b_start, since)
 
-        page = await response.json()
+            if PROJECTION.get(portal_type, None):
+                page["items"] = [
+                    entity_project(entity, PROJECTION[portal_type])
+                    for entity in page.get("items", [])
+                ]
 
-        result = (_result or []) + page.get("items", [])
+            if spool:
+                spool_save(spool, b_start, page)
+        else:
+            click.echo(f"Loading {portal_type} from spool, b_start={b_start}")
 
-        time.sleep(float(os.environ.get("CRAWL_INTERVAL", 1)))
+        return page
 
+    page = await page_get(0)
+    offsets = iter(page_offsets(page))
+
+    def schedule(count):
         return (
-            await fetch(
-                portal_type,
-                session_api,
-                parse_qs(urlsplit(page["batching"]["next"]).query)["b_start"][0],
-                result,
-            )
-            if "next" in page.get("batching", {})
-            else result
+            asyncio.ensure_future(page_get(b_start))
+            for b_start in islice(offsets, count)
         )
 
+    # only keep a window of pages in flight, so that memory use is bounded by the
+    # concurrency limit rather than by the number of pages
+    pending = deque(schedule(client.throttle.concurrency))
+
+    try:
+        yield page
+
+        while pending:
+            page = await pending.popleft()
+
+            pending.extend(schedule(1))
 
-async def node_build(node_builder, portal_type, session):
-    result = []
+            yield page
+    finally:
+        for task in pending:
+            task.cancel()
 
-    for entity in await fetch(portal_type, session):
+
+async def page_fetch(portal_type, client, b_start, since=None):
+    return await client.get_json(
+        os.environ.get("ENDPOINT_API", "https://politikus.sinarproject.org/@search"),
+        param_build(portal_type, b_start, since),
+        (
+            set(path[0] for path in PROJECTION[portal_type])
+            if PROJECTION.get(portal_type, None)
+            else None
+        ),
+    )
+
+
+def page_offsets(page):
+    # offsets are computed from the first page, where b_start is 0
+    if "next" not in page.get("batching", {}):
+        return range(0)
+
+    b_size = int(parse_qs(urlsplit(page["batching"]["next"]).query)["b_start"][0])
+
+    return range(b_size, page.get("items_total", 0), b_size)
+
+
+def node_build(node_builder, entities):
+    for entity in entities:
         try:
-            result.append(node_builder(entity))
+            built = node_builder(entity)
 
         except (KeyError, TypeError) as error:
             from pprint import pformat
@@ -339,17 +456,13 @@ async def node_build(node_builder, portal_type, session):
                 pformat(entity),
             )
 
-    return result
+            continue
+
+        yield built
 
 
 def node_is_class(node):
-    return node in (
-        TYPE_PERSON,
-        TYPE_RELATIONSHIP,
-        TYPE_ORGANIZATION,
-        TYPE_POST,
-        TYPE_MEMBERSHIP,
-    )
+    return node in CLASS_LIST
 
 
 def predicate_attribute_filter_empty(attributes):
@@ -364,48 +477,96 @@ def relationship_filter_empty(result):
     ]
 
 
-def session_start_http():
-    return aiohttp.ClientSession(
-        headers={"Accept": "application/json"},
-        json_serialize=ujson.dumps,
-        auth=(
-            aiohttp.BasicAuth(
-                os.environ["API_AUTH_USER"], os.environ.get("API_AUTH_PASS", None)
-            )
-            if os.environ.get("API_AUTH_USER", False)
+def tree_build(node_builder, entities):
+    tree = {"nodes": {}, "relationships": []}
+
+    for node, relationships in node_build(node_builder, entities):
+        if node:
+            tree["nodes"][node["id"]] = node
+
+        tree["relationships"].extend(relationships)
+
+    return tree
+
+
+async def tree_import(tree_type, portal_type, node_builder, **options):
+    await tree_import_many(((tree_type, portal_type, node_builder),), **options)
+
+
+async def tree_import_many(tree_list, delta=False, resume=False, offline=False):
+    shard_directory_init()
+
+    state = state_load()
+
+    # a delta sync only makes sense on top of what the last sync left
+    since_list = {
+        portal_type: (
+            watermark_get(state, portal_type)
+            if delta and shard_exists(tree_type)
             else None
-        ),
-    )
+        )
+        for tree_type, portal_type, _node_builder in tree_list
+    }
 
+    async with client_start(offline) as client:
+        # every portal type shares the client, along with its session and throttle,
+        # and builds its own shard as its pages arrive
+        async def tree_insert_stream(tree_type, portal_type, node_builder):
+            since = since_list[portal_type]
+            graph = shard_load(tree_type) if since else nx.MultiDiGraph()
+            watermark = since
 
-async def tree_build(portal_type, node_builder, session):
-    return reduce(
-        lambda current, incoming: dict(
-            {},
-            nodes=dict(current["nodes"], **{incoming[0]["id"]: incoming[0]})
-            if incoming[0]
-            else current["nodes"],
-            relationships=current["relationships"] + incoming[1],
-        ),
-        await node_build(node_builder, portal_type, session),
-        {"nodes": {}, "relationships": []},
-    )
+            async for page in fetch(
+                portal_type,
+                client,
+                since,
+                spool_open(portal_type, since, resume),
+            ):
+                tree_insert(
+                    graph,
+                    **tree_build(node_builder, page.get("items", [])),
+                    upsert=bool(since),
+                )
+
+                watermark = max(
+                    [watermark or ""]
+                    + [item.get("modified") or "" for item in page.get("items", [])]
+                )
+
+            return graph, watermark
+
+        result = await asyncio.gather(
+            *(
+                tree_insert_stream(tree_type, portal_type, node_builder)
+                for tree_type, portal_type, node_builder in tree_list
+            )
+        )
 
+    for (tree_type, portal_type, _node_builder), (graph, _watermark) in zip(
+        tree_list, result
+    ):
+        shard_save(tree_type, graph)
+        spool_clear(portal_type)
 
-async def tree_import(tree_type, portal_type, node_builder):
-    async with session_start_http() as session:
-        graph = graph_init()
+    # syncs of other portal types may have finished meanwhile in other processes
+    state = state_load()
 
-        graph_prune(graph, tree_type)
+    for (_tree_type, portal_type, _node_builder), (_graph, watermark) in zip(
+        tree_list, result
+    ):
+        watermark_set(state, portal_type, watermark, not since_list[portal_type])
 
-        tree_insert(graph, **await tree_build(portal_type, node_builder, session))
+    state_save(state)
 
-        graph_save(graph)
 
+def tree_insert(graph, nodes, relationships, upsert=False):
+    if upsert:
+        for node_id in nodes:
+            if node_id in graph:
+                node_prune(graph, node_id)
 
-def tree_insert(graph, nodes, relationships):
     for node_id, node in nodes.items():
-        graph.add_node(node_id, **node)
+        graph.add_node(node_id, **blob_offload(node))
 
     for relationship in relationships:
         graph.add_edge(
@@ -414,3 +575,94 @@ def tree_insert(graph, nodes, relationships):
             key=relationship["predicate"]["key"],
             **relationship["predicate"]["attributes"],
         )
+
+        if relationship["predicate"]["key"] == KEY_TYPE:
+            node_set_type(graph, relationship["subject"], relationship["object"])
+
+
+def watermark_get(state, portal_type):
+    # fall back to a full sync when the last reconciliation is too old, so that
+    # deletions at the source are eventually picked up
+    reconciled = get_in(["reconciled", portal_type], state, None)
+
+    if not reconciled or datetime.now(timezone.utc) - datetime.fromisoformat(
+        reconciled
+    ) > timedelta(days=float(os.environ.get("SYNC_RECONCILE_DAYS", 7))):
+        return None
+
+    return get_in(["watermark", portal_type], state, None)
+
+
+def watermark_reset(state):
+    # once the cache is replaced, the next --delta sync starts over with a full one
+    state.pop("watermark", None)
+    state.pop("reconciled", None)
+
+
+def watermark_set(state, portal_type, watermark, reconciled):
+    if watermark:
+        state.setdefault("watermark", {})[portal_type] = watermark
+
+    if reconciled:
+        state.setdefault("reconciled", {})[portal_type] = datetime.now(
+            timezone.utc
+        ).isoformat()
+
+
+TREE_LIST = (
+    (TYPE_PERSON, "Person", person_build_node),
+    (TYPE_RELATIONSHIP, "Relationship", relationship_build_node),
+    (TYPE_ORGANIZATION, "Organization", organization_build_node),
+    (TYPE_POST, "Post", post_build_node),
+    (TYPE_MEMBERSHIP, "Membership", membership_build_node),
+    (TYPE_OWNERSHIP, "Ownership Control Statement", ownership_build_node),
+)
+
+# the fields read by each *_build_node, plus modified for --delta
+PROJECTION = {
+    "Person": (
+        ("@id",),
+        ("name",),
+        ("gender", "token"),
+        ("image", "download"),
+        ("summary",),
+        ("biography", "data"),
+        ("modified",),
+    ),
+    "Relationship": (
+        ("relationship_subject", "@id"),
+        ("relationship_object", "@id"),
+        ("relationship_type", "token"),
+        ("modified",),
+    ),
+    "Organization": (
+        ("@id",),
+        ("name",),
+        ("classification", "token"),
+        ("parent_organization", "@id"),
+        ("modified",),
+    ),
+    "Post": (
+        ("@id",),
+        ("label",),
+        ("role",),
+        ("organization", "@id"),
+        ("modified",),
+    ),
+    "Membership": (
+        ("@id",),
+        ("label",),
+        ("person", "@id"),
+        ("organization", "@id"),
+        ("post", "@id"),
+        ("on_behalf_of", "@id"),
+        ("modified",),
+    ),
+    "Ownership Control Statement": (
+        ("interestedParty", "@id"),
+        ("interest_level", "token"),
+        ("interest_type", "token"),
+        ("bods_subject", "@id"),
+        ("modified",),
+    ),
+}
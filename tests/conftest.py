@@ -0,0 +1,23 @@
+import pytest
+
+# every file the commands read and write, kept apart for every test
+PATH_LIST = (
+    ("CACHE_STORE_PATH", "cache.sqlite3"),
+    ("CACHE_SHARD_PATH", "shards"),
+    ("CACHE_PATH", "cache.gpickle"),
+    ("STATE_PATH", "state.json"),
+    ("BLOB_PATH", "blobs.bin"),
+    ("SPOOL_PATH", "spool"),
+    ("OWNERSHIP_CACHE_PATH", "ownership.json"),
+    ("LAYOUT_CACHE_PATH", "layout.json"),
+    ("NEO4J_SNAPSHOT_PATH", "snapshot.json"),
+)
+
+
+@pytest.fixture(autouse=True)
+def path_isolate(tmp_path, monkeypatch):
+    # a test never writes to, or reads from, the defaults in the working directory
+    for name, path in PATH_LIST:
+        monkeypatch.setenv(name, str(tmp_path / path))
+
+    monkeypatch.delenv("HTTP_CACHE_PATH", raising=False)
@@ -0,0 +1,106 @@
+import io
+
+import networkx as nx
+import pytest
+
+from popit_relationship import analyze, export, importer, store
+from popit_relationship.common import KEY_TYPE, node_set_type
+from popit_relationship.sync import TYPE_PERSON
+
+
+def test_graph_analyze(monkeypatch):
+    monkeypatch.setenv("ANALYZE_CHUNK_SIZE", "2")
+
+    graph = nx.MultiDiGraph()
+    for source, dest in (("a", "b"), ("b", "c"), ("c", "d"), ("d", "e"), ("x", "y")):
+        graph.add_edge(source, dest, key="member")
+
+    graph.add_edge("c", "a", key="parent")
+
+    for node in ("a", "b", "c", "d", "e", "x", "y"):
+        graph.add_edge(node, TYPE_PERSON, key=KEY_TYPE)
+        node_set_type(graph, node, TYPE_PERSON)
+
+    store.graph_save(graph)
+
+    assert analyze.graph_analyze(workers=2)
+
+    expected = nx.betweenness_centrality(analyze.analysis_graph_build(graph))
+    result = store.graph_init()
+
+    assert "betweenness_centrality" not in result.nodes[TYPE_PERSON]
+    assert [result.nodes[node]["component"] for node in "abcdexy"] == [
+        0,
+        0,
+        0,
+        0,
+        0,
+        1,
+        1,
+    ]
+    assert result.nodes["x"]["component_size"] == 2
+    assert result.nodes["c"]["degree_centrality"] == pytest.approx(3 / 6)
+
+    for node in "abcdexy":
+        assert result.nodes[node]["betweenness_centrality"] == pytest.approx(
+            expected[node]
+        )
+
+    # relationships did not change, only the attributes written by the analysis
+    assert not analyze.graph_analyze(workers=2)
+    assert analyze.graph_analyze(workers=2, force=True)
+
+    shard = store.shard_load(TYPE_PERSON)
+    shard.add_edge("e", "x", key="member")
+    store.shard_save(TYPE_PERSON, shard)
+
+    assert analyze.graph_analyze(workers=2)
+    assert store.graph_init().nodes["y"]["component_size"] == 7
+
+    # metrics of a node removed from its shard are dropped with the next analysis
+    shard.remove_node("e")
+    store.shard_save(TYPE_PERSON, shard)
+
+    assert analyze.graph_analyze(workers=2)
+    assert "e" not in store.shard_load(analyze.SHARD_ANALYSIS)
+    assert "e" not in store.graph_init()
+
+
+def test_graph_analyze_import():
+    graph = nx.MultiDiGraph()
+
+    for source, dest in (("a", "b"), ("x", "y")):
+        graph.add_edge(source, dest, key="member")
+
+    for node in ("a", "b", "x", "y"):
+        graph.add_node(node, id=node)
+        graph.add_edge(node, TYPE_PERSON, key=KEY_TYPE)
+        node_set_type(graph, node, TYPE_PERSON)
+
+    store.graph_save(graph)
+    analyze.graph_analyze(workers=1)
+
+    # metrics are not exported, so an import does not copy them into the type shards
+    with store.store_open() as connection:
+        jsonl = "".join(export.jsonl_build(connection))
+
+    assert "component" not in jsonl
+
+    importer.graph_import(importer.jsonl_read(io.StringIO(jsonl)))
+
+    assert "component" not in store.shard_load(TYPE_PERSON).nodes["a"]
+
+    shard = store.shard_load(TYPE_PERSON)
+    shard.add_edge("b", "x", key="member")
+    store.shard_save(TYPE_PERSON, shard)
+    # e.g. left there by an import of an older export
+    stale = nx.MultiDiGraph()
+    stale.add_node("a", component_size=2)
+    store.shard_save("http://www.w3.org/ns/org#Organization", stale)
+    analyze.graph_analyze(workers=1)
+
+    # and the analysis is merged last, whatever the other shards say
+    result = store.graph_init()
+
+    assert result.nodes["a"]["component_size"] == 4
+    assert result.nodes["a"]["id"] == "a"
@@ -0,0 +1,43 @@
+from popit_relationship import blob
+
+
+def test_blob_offload(monkeypatch):
+    attributes = blob.blob_offload(
+        {"id": "a", "summary": "Sum", "biography": "<p>Biografi</p>"}
+    )
+
+    assert attributes["id"] == "a"
+    assert attributes["summary"] == {blob.KEY_BLOB: [blob.HEADER.size, 3]}
+    assert blob.blob_offload({"summary": "Sum"}) == {"summary": attributes["summary"]}
+    assert blob.blob_resolve(attributes) == {
+        "id": "a",
+        "summary": "Sum",
+        "biography": "<p>Biografi</p>",
+    }
+
+    # another process starts with the index read back from the file
+    monkeypatch.setattr(blob, "_store_list", {})
+
+    assert blob.blob_offload({"biography": "<p>Biografi</p>"}) == {
+        "biography": attributes["biography"]
+    }
+    assert blob.blob_get(blob.blob_offload({"summary": "New"})["summary"]) == "New"
+
+
+def test_blob_reset(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob, "_store_list", {})
+
+    summary = blob.blob_offload({"summary": "Sum"})["summary"]
+
+    assert blob.blob_get(summary) == "Sum"
+
+    # references left behind are read as missing, whether the file is gone or empty
+    blob.blob_reset()
+
+    assert not (tmp_path / "blobs.bin").exists()
+    assert blob.blob_get(summary) is None
+
+    (tmp_path / "blobs.bin").touch()
+
+    assert blob.blob_get(summary) is None
+    assert blob.blob_get(blob.blob_offload({"summary": "New"})["summary"]) == "New"
@@ -0,0 +1,227 @@
+import asyncio
+
+import aiohttp
+import click
+import pytest
+import ujson
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from popit_relationship import client
+
+
+def test_response_cache(tmp_path):
+    key = client.response_cache_key(
+        "https://politikus.sinarproject.org/@search",
+        {"portal_type": "Person", "b_start": 0},
+    )
+
+    assert key == client.response_cache_key(
+        "https://politikus.sinarproject.org/@search",
+        {"b_start": 0, "portal_type": "Person"},
+    )
+    assert client.response_cache_meta(str(tmp_path), key) is None
+
+    with client.response_cache_open(str(tmp_path), key, {"etag": '"abc"'}) as file:
+        file.write(b'{"items_total": 1, "items": [{"@id": "a", "name": "b"}]}')
+
+    meta = client.response_cache_meta(str(tmp_path), key)
+
+    assert meta == {"etag": '"abc"'}
+    assert client.response_cache_headers(meta) == {"If-None-Match": '"abc"'}
+    assert client.response_cache_decode(str(tmp_path), key, {"@id"}) == {
+        "items_total": 1,
+        "items": [{"@id": "a"}],
+    }
+
+
+def test_retry_after_get():
+    assert client.retry_after_get({"Retry-After": "120"}) == 120
+    assert client.retry_after_get({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0
+    assert client.retry_after_get({}) == 0
+
+
+def test_page_decode():
+    body = ujson.dumps(
+        {
+            "batching": {
+                "next": "https://politikus.sinarproject.org/@search?b_start=2"
+            },
+            "items": [
+                {
+                    "@id": "a",
+                    "name": "A",
+                    "@components": {"actions": {"items": [{"@id": "a/@actions"}]}},
+                    "score": 0.5,
+                },
+                "b",
+                None,
+                [{"name": "C"}],
+            ],
+            "items_total": 4,
+        }
+    ).encode("utf-8")
+    expected = {
+        "batching": {"next": "https://politikus.sinarproject.org/@search?b_start=2"},
+        "items": [{"@id": "a", "name": "A", "score": 0.5}, "b", None, [{"name": "C"}]],
+        "items_total": 4,
+    }
+
+    assert client.page_decode(body, {"@id", "name", "score"}) == expected
+    assert client.page_decode(body) == ujson.loads(body)
+
+    # however the body is split as it streams in
+    decoder = client.PageDecoder({"@id", "name", "score"})
+
+    for index in range(len(body)):
+        decoder.feed(body[index : index + 1])
+
+    assert decoder.close() == expected
+
+
+def test_client_start(tmp_path, monkeypatch):
+    async def cache_path_get(offline):
+        async with client.client_start(offline) as http:
+            return http.cache_path
+
+    monkeypatch.delenv("HTTP_CACHE_PATH", raising=False)
+
+    # online syncs only cache their responses when asked to
+    assert asyncio.run(cache_path_get(False)) is None
+
+    with pytest.raises(click.ClickException):
+        asyncio.run(cache_path_get(True))
+
+    monkeypatch.setenv("HTTP_CACHE_PATH", str(tmp_path))
+
+    assert asyncio.run(cache_path_get(False)) == str(tmp_path)
+    assert asyncio.run(cache_path_get(True)) == str(tmp_path)
+
+    (tmp_path / "ab").mkdir()
+    client.response_cache_clear()
+
+    assert not tmp_path.exists()
+
+
+def test_throttle():
+    async def run():
+        throttle = client.Throttle(
+            4, 1.0, rate_min=0.4, rate_max=2.0, rate_step=0.5, latency_target=2.0
+        )
+
+        # additive increase up to rate_max while responses are quick
+        throttle.speed_up(0.1)
+
+        assert throttle.bucket.rate == 1.5
+
+        throttle.speed_up(0.1)
+        throttle.speed_up(0.1)
+
+        assert throttle.bucket.rate == 2.0
+
+        # halved on a slow response, only once for the requests in flight alongside
+        throttle.speed_up(3.0)
+        throttle.slow_down()
+
+        assert throttle.bucket.rate == 1.0
+
+        throttle.slowed -= 3.0
+        throttle.slow_down(retry_after=5)
+
+        assert throttle.bucket.rate == 0.5
+        assert throttle.bucket.paused_until == pytest.approx(
+            asyncio.get_running_loop().time() + 5, abs=0.5
+        )
+
+        throttle.slowed -= 3.0
+        throttle.slow_down()
+
+        assert throttle.bucket.rate == 0.4
+
+        # an unlimited rate stays so
+        throttle = client.Throttle(4, 0)
+        throttle.speed_up(0.1)
+        throttle.slow_down()
+
+        assert throttle.bucket.rate == 0
+
+    asyncio.run(run())
+
+
+def test_get_json(tmp_path, monkeypatch):
+    monkeypatch.setenv("CRAWL_RETRIES", "2")
+    monkeypatch.setenv("CRAWL_BACKOFF", "0")
+
+    status_list, request_list = [], []
+
+    async def search(request):
+        request_list.append(request.headers.get("If-None-Match"))
+
+        if status_list:
+            status = status_list.pop(0)
+
+            return web.Response(status=status, headers={"Retry-After": "0"})
+
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+
+        return web.json_response(
+            {"items": [{"@id": "a", "name": "A"}], "items_total": 1},
+            headers={"ETag": '"v1"'},
+        )
+
+    app = web.Application()
+    app.router.add_get("/@search", search)
+
+    async def run():
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            url = str(server.make_url("/@search"))
+            params = [("portal_type", "Person")]
+            throttle = client.Throttle(4, 0)
+            http = client.Client(session, throttle, str(tmp_path))
+
+            # 429 and 5xx are retried, up to CRAWL_RETRIES times
+            status_list.extend((503, 429))
+
+            assert await http.get_json(url, params, {"@id"}) == {
+                "items": [{"@id": "a"}],
+                "items_total": 1,
+            }
+            assert len(request_list) == 3
+
+            # the cached response is revalidated, and read again when unchanged
+            assert (await http.get_json(url, params))["items"] == [
+                {"@id": "a", "name": "A"}
+            ]
+            assert request_list[-1] == '"v1"'
+
+            request_list.clear()
+            status_list.extend((503, 503, 503))
+
+            with pytest.raises(client.ResponseTransientError):
+                await http.get_json(url, params)
+
+            assert len(request_list) == 3
+
+            # other errors are not
+            request_list.clear()
+            status_list.append(404)
+
+            with pytest.raises(aiohttp.ClientResponseError) as error:
+                await http.get_json(url, params)
+
+            assert error.value.status == 404
+            assert len(request_list) == 1
+
+            # nothing is fetched offline, what is not cached is an error
+            offline = client.Client(session, throttle, str(tmp_path), offline=True)
+            request_list.clear()
+
+            assert (await offline.get_json(url, params))["items_total"] == 1
+
+            with pytest.raises(click.ClickException):
+                await offline.get_json(url, [("portal_type", "Post")])
+
+            assert request_list == []
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+import networkx as nx
+
+from popit_relationship import common
+
+
+def test_node_prune():
+    graph = nx.MultiDiGraph()
+    graph.add_node("person", name="Person")
+    graph.add_edge("person", "type", key=common.KEY_TYPE)
+    graph.add_edge("person", "organization", key="member")
+    graph.add_edge("membership", "person", key="member")
+    graph.add_edge("orphan", "type", key=common.KEY_TYPE)
+
+    common.node_prune(graph, "person")
+    common.node_prune(graph, "orphan")
+
+    assert "orphan" not in graph
+    assert graph.nodes["person"] == {}
+    assert list(graph.out_edges("person")) == []
+    assert graph.has_edge("membership", "person", "member")
+
+
+def test_node_type_index():
+    graph = nx.MultiDiGraph()
+    graph.add_edge("person", "type", key=common.KEY_TYPE)
+    graph.add_edge("person", "organization", key="member")
+
+    assert common.node_get_type(graph, "person") == "type"
+    assert common.node_get_type(graph, "organization") is False
+
+    common.node_set_type(graph, "organization", "other")
+    common.node_prune(graph, "person")
+
+    assert common.node_get_type(graph, "person") is False
+    assert common.node_get_type(graph, "organization") == "other"
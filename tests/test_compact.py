@@ -0,0 +1,48 @@
+import networkx as nx
+
+from popit_relationship import compact
+from popit_relationship.common import KEY_TYPE, node_get_type
+
+
+def test_compact_build():
+    graph = nx.MultiDiGraph()
+    graph.add_node("a", name="A")
+    graph.add_edge("a", "type", key=KEY_TYPE)
+    graph.add_edge("a", "b", key="member", interest_level="high")
+    graph.add_edge("c", "a", key="member")
+    graph.add_edge("a", "b", key="parent")
+
+    result = compact.compact_build(graph)
+    a = result.node_code("a")
+
+    assert (result.number_of_nodes(), result.number_of_edges()) == (4, 4)
+    assert sorted(result.node_list[node] for node in result.neighbours(a)) == [
+        "b",
+        "c",
+        "type",
+    ]
+    assert [result.node_list[node] for node in result.successors(a, ["member"])] == [
+        "b"
+    ]
+    assert result.degree()[a] == 4
+
+    graph_result = compact.compact_to_graph(result)
+
+    assert sorted(graph_result.edges(keys=True, data=True)) == sorted(
+        graph.edges(keys=True, data=True)
+    )
+    assert dict(graph_result.nodes(data=True)) == dict(graph.nodes(data=True))
+    assert node_get_type(graph_result, "a") == "type"
+
+    # a node is read back along with every edge it is an end of
+    subgraph = compact.compact_subgraph(result, ["a", "missing"])
+
+    assert sorted(subgraph.edges(keys=True, data=True)) == sorted(
+        graph.edges(keys=True, data=True)
+    )
+    assert subgraph.nodes["a"] == {"name": "A"}
+    assert subgraph.nodes["c"] == {}
+    assert node_get_type(subgraph, "a") == "type"
+    assert sorted(
+        compact.compact_predicate_graph(result, ["member"]).edges(keys=True, data=True)
+    ) == [("a", "b", "member", {"interest_level": "high"}), ("c", "a", "member", {})]
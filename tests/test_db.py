@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+
+import networkx as nx
+
+from popit_relationship import db
+from popit_relationship.common import KEY_TYPE
+from popit_relationship.sync import TYPE_PERSON, tree_insert
+
+
+def test_batch_build():
+    graph = nx.MultiDiGraph()
+    tree_insert(
+        graph,
+        {"https://politikus.sinarproject.org/persons/a": {"name": "A"}},
+        [
+            {
+                "subject": "https://politikus.sinarproject.org/persons/a",
+                "predicate": {"key": KEY_TYPE, "attributes": {}},
+                "object": TYPE_PERSON,
+            },
+            {
+                "subject": "https://politikus.sinarproject.org/persons/a",
+                "predicate": {
+                    "key": "http://purl.org/vocab/relationship/Relationship",
+                    "attributes": {
+                        "name": "parent",
+                        "uri": "http://purl.org/vocab/relationship/parentOf",
+                    },
+                },
+                "object": "https://politikus.sinarproject.org/persons/b",
+            },
+        ],
+    )
+
+    node_batch, relationship_batch = db.batch_build(graph)
+
+    assert dict(node_batch) == {
+        "Person": [
+            {
+                "id": "https://politikus.sinarproject.org/persons/a",
+                "attributes": {
+                    "id": "https://politikus.sinarproject.org/persons/a",
+                    "name": "A",
+                },
+            }
+        ],
+        None: [
+            {
+                "id": "https://politikus.sinarproject.org/persons/b",
+                "attributes": {"id": "https://politikus.sinarproject.org/persons/b"},
+            }
+        ],
+    }
+    assert dict(relationship_batch) == {
+        ("parentOf", "Person", None): [
+            {
+                "source": "https://politikus.sinarproject.org/persons/a",
+                "dest": "https://politikus.sinarproject.org/persons/b",
+                "predicate": "http://purl.org/vocab/relationship/parentOf",
+                "key": "http://purl.org/vocab/relationship/Relationship",
+                "data": {
+                    "data_name": "parent",
+                    "data_uri": "http://purl.org/vocab/relationship/parentOf",
+                },
+            }
+        ]
+    }
+
+
+class DriverMock:
+    def __init__(self):
+        self.written = []
+
+    @contextmanager
+    def session(self):
+        yield self
+
+    def write_transaction(self, function, *args):
+        self.written.append((function.__name__, args[:-1], len(args[-1])))
+
+
+def test_graph_save_differential():
+    graph = nx.MultiDiGraph()
+    graph.add_node("a", name="A")
+    graph.add_edge("a", TYPE_PERSON, key=KEY_TYPE)
+    graph.add_edge("a", "b", key="http://www.w3.org/ns/org#member")
+    graph.add_edge("a", "c", key="http://www.w3.org/ns/org#member")
+
+    driver = DriverMock()
+    db.graph_save(driver, graph)
+
+    assert [write[0] for write in driver.written] == [
+        "constraint_create",
+        "node_save_batch",
+        "node_save_batch",
+        "relationship_save_batch",
+    ]
+
+    graph.nodes["a"]["name"] = "B"
+    graph.remove_edge("a", "c", "http://www.w3.org/ns/org#member")
+
+    driver = DriverMock()
+    db.graph_save(driver, graph, workers=2)
+
+    assert driver.written[1:] == [
+        ("relationship_delete_batch", ("member", "Person", None), 1),
+        ("node_delete_batch", (None,), 1),
+        ("node_save_batch", ("Person",), 1),
+    ]
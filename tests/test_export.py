@@ -0,0 +1,54 @@
+import csv
+
+import networkx as nx
+
+from popit_relationship import export
+from popit_relationship.common import KEY_TYPE, node_set_type
+
+
+def test_neo4j_csv_write(tmp_path):
+    graph = nx.MultiDiGraph()
+
+    graph.add_node("b", id="b", name="Org B")
+    graph.add_node("a", id="a", name="Person A", biography="line\nbreak")
+    graph.add_edge("a", "http://www.w3.org/ns/person#Person", key=KEY_TYPE)
+    graph.add_edge("b", "http://www.w3.org/ns/org#Organization", key=KEY_TYPE)
+    node_set_type(graph, "a", "http://www.w3.org/ns/person#Person")
+    node_set_type(graph, "b", "http://www.w3.org/ns/org#Organization")
+    graph.add_edge(
+        "a", "b", key="http://www.w3.org/ns/org#member", interest_level="high"
+    )
+
+    assert sorted(export.node_csv_write(graph, tmp_path)) == [
+        str(tmp_path / "nodes-Organization.csv"),
+        str(tmp_path / "nodes-Person.csv"),
+    ]
+    assert export.relationship_csv_write(graph, tmp_path) == [
+        str(tmp_path / "relationships-member.csv")
+    ]
+
+    with open(tmp_path / "nodes-Person.csv", newline="") as csv_file:
+        assert list(csv.reader(csv_file)) == [
+            ["id:ID", "biography", "name", ":LABEL"],
+            ["a", "line\nbreak", "Person A", "Person"],
+        ]
+
+    with open(tmp_path / "relationships-member.csv", newline="") as csv_file:
+        assert list(csv.reader(csv_file)) == [
+            [
+                ":START_ID",
+                ":END_ID",
+                ":TYPE",
+                "predicate",
+                "key",
+                "data_interest_level",
+            ],
+            [
+                "a",
+                "b",
+                "member",
+                "http://www.w3.org/ns/org#member",
+                "http://www.w3.org/ns/org#member",
+                "high",
+            ],
+        ]
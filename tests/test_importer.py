@@ -0,0 +1,66 @@
+import io
+
+import networkx as nx
+
+from popit_relationship import export, importer, store
+from popit_relationship.blob import HEADER
+from popit_relationship.common import KEY_TYPE, node_set_type, state_load, state_save
+
+
+def test_graph_import(tmp_path, monkeypatch):
+    monkeypatch.setenv("IMPORT_CHUNK_SIZE", "2")
+
+    graph = nx.MultiDiGraph()
+    graph.add_node(
+        "https://x/person/b",
+        id="https://x/person/b",
+        name='Quote " and \\ slash',
+        biography="line\nbreak é",
+        rank=2,
+        score=0.5,
+        active=True,
+        tags=["a", "b"],
+    )
+    graph.add_node("https://x/org/a", id="https://x/org/a", name="Org")
+    graph.add_edge(
+        "https://x/person/b", "http://www.w3.org/ns/person#Person", key=KEY_TYPE
+    )
+    node_set_type(graph, "https://x/person/b", "http://www.w3.org/ns/person#Person")
+    graph.add_edge(
+        "https://x/person/b",
+        "https://x/org/a b",
+        key="http://purl.org/vocab/relationship/employerOf",
+        name="employer",
+        interest_level=0.25,
+    )
+    graph.add_edge("https://x/org/a", "https://x/person/b", key="http://x/member")
+    store.graph_save(graph)
+
+    with store.store_open() as connection:
+        jsonl = "".join(export.jsonl_build(connection))
+        ntriples = "".join(export.ntriples_build(connection))
+
+    assert "<https://x/org/a\\u0020b>" in ntriples
+
+    for read, content in (
+        (importer.jsonl_read, jsonl),
+        (importer.ntriples_read, ntriples),
+    ):
+        state_save({"watermark": {"Person": "2020"}, "other": 1})
+        store.graph_save(nx.MultiDiGraph())
+        importer.graph_import(read(io.StringIO(content)))
+
+        # the same lines come out of what was imported, whichever format it was
+        with store.store_open() as connection:
+            assert "".join(export.jsonl_build(connection)) == jsonl
+            assert "".join(export.ntriples_build(connection)) == ntriples
+
+        assert state_load() == {"other": 1}
+        # biographies are kept in the blob file again, and only once
+        assert list(store.graph_init().nodes["https://x/person/b"]["biography"]) == [
+            "@blob"
+        ]
+
+    assert (tmp_path / "blobs.bin").stat().st_size == HEADER.size + len(
+        "line\nbreak é".encode("utf-8")
+    )
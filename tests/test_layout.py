@@ -0,0 +1,19 @@
+import networkx as nx
+
+from popit_relationship import layout
+
+
+def test_layout_build_spring():
+    graph = nx.MultiDiGraph()
+    graph.add_edge("a", "b", key="member")
+    graph.add_edge("b", "c", key="member")
+
+    first = layout.layout_build(nx.subgraph(graph, ["a", "b"]))
+
+    assert layout.layout_cache_load() == first
+
+    # nodes already placed are only refined, not moved across the plane
+    second = layout.layout_build(graph, iterations=0)
+
+    assert second["a"] == first["a"] and second["b"] == first["b"]
+    assert sorted(layout.layout_cache_load()) == ["a", "b", "c"]
@@ -0,0 +1,50 @@
+import networkx as nx
+
+from popit_relationship import neighbourhood
+from popit_relationship.common import KEY_RELATIONSHIP, KEY_TYPE
+from popit_relationship.compact import compact_build
+from popit_relationship.sync import TYPE_PERSON
+
+
+def test_neighbourhood_build():
+    graph = nx.MultiDiGraph()
+    graph.add_edge("a", TYPE_PERSON, key=KEY_TYPE)
+    graph.add_edge("b", TYPE_PERSON, key=KEY_TYPE)
+    graph.add_edge("a", "b", key="member")
+    graph.add_edge("c", "b", key="owner")
+    graph.add_edge("c", "d", key="member")
+
+    assert neighbourhood.neighbourhood_build(graph, ["a"], 3) == {
+        "a": 0,
+        "b": 1,
+        "c": 2,
+        "d": 3,
+    }
+    assert neighbourhood.neighbourhood_build(graph, ["a"], 3, 2) == {"a": 0, "b": 1}
+    assert neighbourhood.neighbourhood_build(
+        graph, ["a"], 3, predicate_list={"member"}
+    ) == {"a": 0, "b": 1}
+    graph.add_edge("d", "e", key=KEY_RELATIONSHIP, uri="spouseOf")
+    graph.add_edge("d", "f", key=KEY_RELATIONSHIP, uri="parentOf")
+
+    # both follow relationships by their key or their precise uri
+    for predicate_list in (None, {"member"}, {"spouseOf"}, {KEY_RELATIONSHIP}):
+        for node_limit in (None, 3):
+            assert neighbourhood.neighbourhood_build_compact(
+                compact_build(graph), ["d"], 3, node_limit, predicate_list
+            ) == neighbourhood.neighbourhood_build(
+                graph, ["d"], 3, node_limit, predicate_list
+            )
+
+    assert neighbourhood.neighbourhood_build_compact(
+        compact_build(graph), ["d"], 1, predicate_list={"spouseOf"}
+    ) == {"d": 0, "e": 1}
+
+    result = neighbourhood.neighbourhood_export(
+        graph, {"a": 0, "b": 1}, predicate_list={"member"}
+    )
+
+    assert [node["id"] for node in result["nodes"]] == ["a", "b"]
+    assert result["edges"] == [
+        {"source": "a", "dest": "b", "key": "member", "attributes": {}}
+    ]
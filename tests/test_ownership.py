@@ -0,0 +1,54 @@
+import networkx as nx
+
+from popit_relationship import ownership, store
+from popit_relationship.sync import TYPE_OWNERSHIP
+
+
+def test_ownership_chain(monkeypatch):
+    graph = nx.MultiDiGraph()
+    graph.add_edge("holding", "company", key=TYPE_OWNERSHIP, interest_level="direct")
+    graph.add_edge("person", "holding", key=TYPE_OWNERSHIP)
+    graph.add_edge("company", "holding", key=TYPE_OWNERSHIP)
+    graph.add_edge("other", "unrelated", key=TYPE_OWNERSHIP)
+    store.shard_save(TYPE_OWNERSHIP, graph)
+
+    assert ownership.ownership_chain("company") == [
+        {
+            "path": [
+                {"id": "holding", "interest_level": "direct"},
+                {"id": "company"},
+            ],
+            "end": "cycle",
+        },
+        {
+            "path": [{"id": "holding", "interest_level": "direct"}, {"id": "person"}],
+            "end": "root",
+        },
+    ]
+    assert ownership.ownership_chain("company", 1) == [
+        {"path": [{"id": "holding", "interest_level": "direct"}], "end": "depth"}
+    ]
+
+    search_count = []
+    chain_search = ownership.chain_search
+    monkeypatch.setattr(
+        ownership,
+        "chain_search",
+        lambda *args: search_count.append(args[1]) or chain_search(*args),
+    )
+
+    # unrelated ownership changes keep the closure cached
+    graph.add_edge("another", "unrelated", key=TYPE_OWNERSHIP)
+    store.shard_save(TYPE_OWNERSHIP, graph)
+    ownership.ownership_chain("company")
+
+    graph.remove_edge("company", "holding", TYPE_OWNERSHIP)
+    store.shard_save(TYPE_OWNERSHIP, graph)
+
+    assert ownership.ownership_chain("company") == [
+        {
+            "path": [{"id": "holding", "interest_level": "direct"}, {"id": "person"}],
+            "end": "root",
+        }
+    ]
+    assert search_count == ["company"]
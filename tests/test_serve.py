@@ -0,0 +1,89 @@
+import asyncio
+
+import networkx as nx
+from aiohttp.test_utils import TestClient, TestServer
+
+from popit_relationship import serve, store
+from popit_relationship.common import KEY_TYPE, node_set_type
+from popit_relationship.sync import TYPE_OWNERSHIP, TYPE_PERSON
+
+
+def test_graph_server():
+    graph = nx.MultiDiGraph()
+    graph.add_node("person", id="person", name="Person")
+    graph.add_node("company", id="company", name="Company")
+    graph.add_edge("person", TYPE_PERSON, key=KEY_TYPE)
+    node_set_type(graph, "person", TYPE_PERSON)
+    graph.add_edge("person", "company", key=TYPE_OWNERSHIP, interest_level="direct")
+    graph.add_edge("company", "subsidiary", key="http://www.w3.org/ns/org#member")
+    store.graph_save(graph)
+
+    async def run():
+        server = serve.GraphServer(reload_interval=3600, cache_size=2)
+
+        async with TestClient(TestServer(server.application())) as client:
+            response = await client.get("/node", params={"id": "person"})
+
+            assert await response.json() == {
+                "id": "person",
+                "type": TYPE_PERSON,
+                "attributes": {"id": "person", "name": "Person"},
+                "out": [
+                    {
+                        "dest": "company",
+                        "key": TYPE_OWNERSHIP,
+                        "attributes": {"interest_level": "direct"},
+                    },
+                    {
+                        "dest": TYPE_PERSON,
+                        "key": KEY_TYPE,
+                        "attributes": {},
+                    },
+                ],
+                "in": [],
+            }
+            assert (await client.get("/node", params={"id": "nobody"})).status == 404
+            assert (await client.get("/neighbourhood?depth=x")).status == 400
+
+            response = await client.get(
+                "/neighbourhood", params={"node": "person", "depth": "1"}
+            )
+
+            assert [node["id"] for node in (await response.json())["nodes"]] == [
+                "person",
+                "company",
+            ]
+
+            response = await client.get("/ownership-chain", params={"id": "company"})
+
+            assert (await response.json())["chains"] == [
+                {
+                    "end": "root",
+                    "path": [
+                        {"id": "person", "name": "Person", "interest_level": "direct"}
+                    ],
+                }
+            ]
+
+            # results are kept until the cache changes, the least recently used first
+            # to go
+            snapshot = server.snapshot
+
+            assert list(snapshot.result_list) == [
+                ("neighbourhood", ("person",), 1, None, None),
+                ("ownership-chain", "company", 10),
+            ]
+
+            graph.add_edge("holding", "company", key=TYPE_OWNERSHIP)
+            store.shard_save(TYPE_OWNERSHIP, graph)
+            await server.reload()
+
+            assert server.snapshot is not snapshot
+
+            response = await client.get("/ownership-chain", params={"id": "company"})
+
+            assert [
+                chain["path"][0]["id"] for chain in (await response.json())["chains"]
+            ] == ["holding", "person"]
+
+    asyncio.run(run())
@@ -0,0 +1,14 @@
+from popit_relationship import spool
+
+
+def test_spool_resume(tmp_path, monkeypatch):
+    monkeypatch.setenv("SPOOL_PATH", str(tmp_path))
+
+    path = spool.spool_open("Person")
+    spool.spool_save(path, 25, {"items": [{"@id": "person"}]})
+
+    assert spool.spool_load(spool.spool_open("Person", resume=True), 25) == {
+        "items": [{"@id": "person"}]
+    }
+    assert spool.spool_load(spool.spool_open("Person", "2020-01-01", True), 25) is None
+    assert spool.spool_load(spool.spool_open("Person"), 25) is None
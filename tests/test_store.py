@@ -0,0 +1,128 @@
+import os
+import pickle
+
+import networkx as nx
+
+from popit_relationship import store
+from popit_relationship.common import (
+    KEY_OWNERSHIP,
+    KEY_RELATIONSHIP,
+    KEY_TYPE,
+    node_get_type,
+    node_set_type,
+)
+
+
+def test_shard_merge():
+    graph = nx.MultiDiGraph()
+    graph.add_node("a", id="a", name="A")
+    graph.add_edge("a", "person", key=KEY_TYPE)
+    graph.add_edge("a", "c", key="member")
+    store.shard_save("person", graph)
+
+    graph = nx.MultiDiGraph()
+    graph.add_node("membership", id="membership")
+    graph.add_edge("membership", "a", key="member")
+    store.shard_save("membership", graph)
+
+    assert sorted(store.graph_init().edges(keys=True)) == [
+        ("a", "c", "member"),
+        ("a", "person", KEY_TYPE),
+        ("membership", "a", "member"),
+    ]
+
+    graph = store.shard_load("person")
+    graph.remove_edge("a", "c", "member")
+    graph.nodes["a"]["name"] = "A2"
+    store.shard_save("person", graph)
+
+    result = store.graph_init()
+
+    assert dict(result.nodes(data=True)) == {
+        "a": {"id": "a", "name": "A2"},
+        "person": {},
+        "c": {},
+        "membership": {"id": "membership"},
+    }
+    assert sorted(result.edges(keys=True)) == [
+        ("a", "person", KEY_TYPE),
+        ("membership", "a", "member"),
+    ]
+    assert node_get_type(result, "a") == "person"
+
+
+def test_graph_init_neighbourhood(tmp_path):
+    graph = nx.MultiDiGraph()
+    graph.add_edge("a", "b", key="member")
+    graph.add_edge("b", "c", key="member")
+    graph.add_edge("c", "d", key="member")
+    graph.add_edge("a", "type", key=KEY_TYPE)
+    graph.add_edge("e", "type", key=KEY_TYPE)
+
+    with open(tmp_path / "cache.gpickle", "wb") as gpickle_file:
+        pickle.dump(graph, gpickle_file)
+
+    result = store.graph_init_neighbourhood(["b"], 1, lambda node: node == "type")
+
+    assert sorted(result.nodes) == ["a", "b", "c", "type"]
+    assert sorted(result.edges(keys=True)) == [
+        ("a", "b", "member"),
+        ("a", "type", KEY_TYPE),
+        ("b", "c", "member"),
+    ]
+    assert node_get_type(result, "a") == "type"
+    assert sorted(store.shard_version_list()) == ["type", "untyped"]
+
+
+def test_graph_save(tmp_path):
+    graph = nx.MultiDiGraph()
+    graph.add_node("a", id="a")
+    graph.add_edge("a", "person", key=KEY_TYPE)
+    node_set_type(graph, "a", "person")
+    graph.add_edge("a", "org", key="member")
+    graph.add_edge("a", "org", key=KEY_OWNERSHIP, interest_level="direct")
+    graph.add_edge("org", "b", key=KEY_RELATIONSHIP)
+    graph.add_node("isolated")
+    store.graph_save(graph)
+
+    assert sorted(store.shard_version_list()) == sorted(
+        [
+            "person",
+            store.shard_name(KEY_OWNERSHIP),
+            store.shard_name(KEY_RELATIONSHIP),
+            "untyped",
+        ]
+    )
+
+    # a sync of persons only replaces what was split into their shard
+    person = store.shard_load("person")
+    person.remove_edge("a", "org", "member")
+    store.shard_save("person", person)
+
+    assert sorted(store.graph_init().edges(keys=True)) == [
+        ("a", "org", KEY_OWNERSHIP),
+        ("a", "person", KEY_TYPE),
+        ("org", "b", KEY_RELATIONSHIP),
+    ]
+
+    store.graph_save(nx.MultiDiGraph())
+
+    assert store.shard_version_list() == {}
+    assert len(store.graph_init()) == 0
+    assert os.listdir(tmp_path / "shards") == []
+
+
+def test_shard_directory_init(tmp_path):
+    graph = nx.MultiDiGraph()
+    graph.add_edge("a", "person", key=KEY_TYPE)
+    graph.add_edge("b", "org", key=KEY_TYPE)
+
+    with open(tmp_path / "cache.gpickle", "wb") as gpickle_file:
+        pickle.dump(graph, gpickle_file)
+
+    store.shard_directory_init()
+
+    # a sync of one type afterwards leaves the others migrated
+    store.shard_save("person", nx.MultiDiGraph())
+
+    assert sorted(store.graph_init().edges(keys=True)) == [("b", "org", KEY_TYPE)]
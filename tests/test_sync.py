@@ -1,6 +1,16 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import networkx as nx
+import pytest
 import ujson
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
-from popit_relationship import sync
+from popit_relationship import store, sync
+from popit_relationship.client import Client, Throttle
+from popit_relationship.common import KEY_TYPE, node_get_type, state_load
 
 
 def test_person_build_node():
@@ -90,3 +100,308 @@ def test_person_build_node():
     )
 
     assert sync.person_build_node(person) == expected
+    assert (
+        sync.person_build_node(sync.entity_project(person, sync.PROJECTION["Person"]))
+        == expected
+    )
+
+
+def test_page_offsets():
+    page = {
+        "items_total": 60,
+        "batching": {
+            "@id": "https://politikus.sinarproject.org/@search?portal_type=Person",
+            "next": "https://politikus.sinarproject.org/@search?portal_type=Person&b_start=25",
+        },
+    }
+
+    assert list(sync.page_offsets(page)) == [25, 50]
+    assert list(sync.page_offsets({"items_total": 10, "batching": {}})) == []
+
+
+def test_projection_param_build():
+    assert sync.projection_param_build(sync.PROJECTION["Person"]) == [
+        ("fullobjects", 1)
+    ]
+    assert sync.projection_param_build((("@id",), ("name",))) == [
+        ("metadata_fields", "@id"),
+        ("metadata_fields", "name"),
+    ]
+
+
+def test_param_build():
+    assert sync.param_build("Post", 25) == [
+        ("portal_type", "Post"),
+        ("fullobjects", 1),
+        ("b_start", 25),
+    ]
+    assert sync.param_build("Post", 0, "2020-06-07T13:04:42+00:00")[-3:] == [
+        ("modified.query", "2020-06-07T13:04:42+00:00"),
+        ("modified.range", "min"),
+        ("sort_on", "modified"),
+    ]
+
+
+def test_watermark(monkeypatch):
+    monkeypatch.setenv("SYNC_RECONCILE_DAYS", "7")
+
+    state = {}
+
+    assert sync.watermark_get(state, "Person") is None
+
+    sync.watermark_set(state, "Person", "2020-06-07T13:04:42+00:00", True)
+    sync.watermark_set(state, "Person", None, False)
+
+    assert sync.watermark_get(state, "Person") == "2020-06-07T13:04:42+00:00"
+
+    # a delta sync never extends the last full one
+    state["reconciled"]["Person"] = (
+        datetime.now(timezone.utc) - timedelta(days=8)
+    ).isoformat()
+    sync.watermark_set(state, "Person", "2020-06-08T00:00:00+00:00", False)
+
+    assert sync.watermark_get(state, "Person") is None
+
+    sync.watermark_set(state, "Person", "2020-06-09T00:00:00+00:00", True)
+    sync.watermark_reset(state)
+
+    assert state == {}
+    assert sync.watermark_get(state, "Person") is None
+
+
+def test_tree_insert_upsert():
+    graph = nx.MultiDiGraph()
+    sync.tree_insert(
+        graph,
+        {"a": {"id": "a", "name": "A", "role": "chair"}},
+        [
+            relationship_build("a", KEY_TYPE, sync.TYPE_POST),
+            relationship_build("a", "http://www.w3.org/ns/org#organization", "org"),
+        ],
+    )
+    sync.tree_insert(
+        graph,
+        {"b": {"id": "b", "name": "B"}},
+        [relationship_build("b", "http://www.w3.org/ns/org#member", "a")],
+    )
+
+    # what the entity said before is replaced, what others say about it is kept
+    sync.tree_insert(
+        graph,
+        {"a": {"id": "a", "name": "A2"}},
+        [relationship_build("a", KEY_TYPE, sync.TYPE_POST)],
+        upsert=True,
+    )
+
+    assert graph.nodes["a"] == {"id": "a", "name": "A2"}
+    assert sorted(graph.edges(keys=True)) == [
+        ("a", sync.TYPE_POST, KEY_TYPE),
+        ("b", "a", "http://www.w3.org/ns/org#member"),
+    ]
+    assert node_get_type(graph, "a") == sync.TYPE_POST
+
+
+def relationship_build(subject, key, object_):
+    return {
+        "subject": subject,
+        "predicate": {"key": key, "attributes": {}},
+        "object": object_,
+    }
+
+
+def search_application(item_list, b_size=2, delay=0.0, status_list=None):
+    # serves @search as plone.restapi does, pages further down answering first
+    log = {"in_flight": 0, "in_flight_max": 0, "b_start": []}
+
+    async def search(request):
+        portal_type = request.query["portal_type"]
+        b_start = int(request.query.get("b_start", 0))
+        since = request.query.get("modified.query", "")
+        items = [
+            item
+            for item in item_list.get(portal_type, [])
+            if item.get("modified", "") >= since
+        ]
+
+        log["b_start"].append((portal_type, b_start))
+
+        if status_list and b_start in status_list:
+            raise web.HTTPNotFound()
+
+        log["in_flight"] += 1
+        log["in_flight_max"] = max(log["in_flight"], log["in_flight_max"])
+
+        try:
+            await asyncio.sleep(delay * (len(items) - b_start))
+        finally:
+            log["in_flight"] -= 1
+
+        page = {"items": items[b_start : b_start + b_size], "items_total": len(items)}
+
+        if b_start + b_size < len(items):
+            page["batching"] = {
+                "next": f"{request.url.with_query(b_start=b_start + b_size)}"
+            }
+
+        return web.json_response(page)
+
+    app = web.Application()
+    app.router.add_get("/@search", search)
+
+    return app, log
+
+
+def person_item_build(index, modified="2020-06-07T13:04:42+00:00"):
+    return {
+        "@id": f"https://x/person/{index}",
+        "name": f"Person {index}",
+        "modified": modified,
+        "UID": f"{index}",
+    }
+
+
+def test_fetch(tmp_path, monkeypatch):
+    monkeypatch.setenv("CRAWL_RETRIES", "0")
+
+    app, log = search_application(
+        {"Person": [person_item_build(index) for index in range(7)]}, delay=0.02
+    )
+
+    async def run():
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            monkeypatch.setenv("ENDPOINT_API", str(server.make_url("/@search")))
+
+            client = Client(session, Throttle(2, 0))
+            page_list = [
+                page async for page in sync.fetch("Person", client, spool=str(tmp_path))
+            ]
+
+            # pages come out in order, however they were answered
+            assert [item["@id"] for page in page_list for item in page["items"]] == [
+                f"https://x/person/{index}" for index in range(7)
+            ]
+            # only the fields read by person_build_node are kept
+            assert "UID" not in page_list[0]["items"][0]
+            # never more requests in flight than the concurrency limit
+            assert log["in_flight_max"] == 2
+
+            # the pages spooled are loaded rather than fetched again
+            log["b_start"].clear()
+
+            assert [
+                page async for page in sync.fetch("Person", client, spool=str(tmp_path))
+            ] == page_list
+            assert log["b_start"] == []
+
+    asyncio.run(run())
+
+
+def test_fetch_error(monkeypatch):
+    monkeypatch.setenv("CRAWL_RETRIES", "0")
+
+    app, _log = search_application(
+        {"Person": [person_item_build(index) for index in range(9)]},
+        delay=0.05,
+        status_list={2},
+    )
+    page_fetch, cancelled = sync.page_fetch, []
+
+    async def page_fetch_spy(portal_type, client, b_start, since=None):
+        try:
+            return await page_fetch(portal_type, client, b_start, since)
+        except asyncio.CancelledError:
+            cancelled.append(b_start)
+            raise
+
+    monkeypatch.setattr(sync, "page_fetch", page_fetch_spy)
+
+    async def run():
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            monkeypatch.setenv("ENDPOINT_API", str(server.make_url("/@search")))
+
+            with pytest.raises(aiohttp.ClientResponseError):
+                async for _page in sync.fetch(
+                    "Person", Client(session, Throttle(2, 0))
+                ):
+                    pass
+
+            await asyncio.sleep(0.1)
+
+            # the page still in flight is given up, those after it never requested
+            assert cancelled == [4]
+
+    asyncio.run(run())
+
+
+def test_tree_import_many(tmp_path, monkeypatch):
+    monkeypatch.setenv("HTTP_CACHE_PATH", str(tmp_path / "http-cache"))
+
+    monkeypatch.setenv("CRAWL_RATE", "0")
+
+    item_list = {
+        "Person": [person_item_build(index) for index in range(3)],
+        "Ownership Control Statement": [
+            {
+                "interestedParty": {"@id": "https://x/person/0"},
+                "bods_subject": {"@id": "https://x/org/a"},
+                "interest_level": {"token": "direct"},
+                "modified": "2020-06-01T00:00:00+00:00",
+            }
+        ],
+    }
+    tree_list = [
+        tree
+        for tree in sync.TREE_LIST
+        if tree[1] in ("Person", "Ownership Control Statement")
+    ]
+
+    async def run(**options):
+        app, log = search_application(item_list)
+
+        async with TestServer(app) as server:
+            monkeypatch.setenv("ENDPOINT_API", str(server.make_url("/@search")))
+
+            await sync.tree_import_many(tree_list, **options)
+
+        return log
+
+    asyncio.run(run())
+
+    # every portal type is kept in a shard of its own, along with its watermark
+    assert sorted(store.shard_load(sync.TYPE_PERSON)) == [
+        sync.TYPE_PERSON,
+        "https://x/person/0",
+        "https://x/person/1",
+        "https://x/person/2",
+    ]
+    assert list(store.shard_load(sync.TYPE_OWNERSHIP).edges(keys=True, data=True)) == [
+        (
+            "https://x/person/0",
+            "https://x/org/a",
+            sync.TYPE_OWNERSHIP,
+            {"interest_level": "direct"},
+        )
+    ]
+    assert store.graph_init().nodes["https://x/person/2"]["name"] == "Person 2"
+
+    state = state_load()
+
+    assert state["watermark"] == {
+        "Person": "2020-06-07T13:04:42+00:00",
+        "Ownership Control Statement": "2020-06-01T00:00:00+00:00",
+    }
+    assert set(state["reconciled"]) == {"Person", "Ownership Control Statement"}
+
+    # a delta sync only asks for what changed, and keeps the rest of the shard
+    item_list["Person"][1] = person_item_build(1, "2020-06-08T00:00:00+00:00")
+    item_list["Person"][1]["name"] = "Person 1 renamed"
+    log = asyncio.run(run(delta=True))
+
+    assert sorted(log["b_start"]) == [
+        ("Ownership Control Statement", 0),
+        ("Person", 0),
+        ("Person", 2),
+    ]
+    assert store.graph_init().nodes["https://x/person/1"]["name"] == "Person 1 renamed"
+    assert len(store.shard_load(sync.TYPE_PERSON)) == 4
+    assert state_load()["watermark"]["Person"] == "2020-06-08T00:00:00+00:00"